@@ -1,14 +1,34 @@
 #!/Library/Frameworks/Python.framework/Versions/3.6/bin/python3.6
 
 import re
+import sys
+from os import environ
+from string import Formatter
+from functools import lru_cache
+from itertools import groupby
+from operator import itemgetter
 
 ANSI_ROUND = [0, 95, 135, 175, 215, 255]
-ANSI_FOREGROUND = re.compile("(?P<begin>%x<#)(?P<hex>[a-fA-F0-9]{6})(?P<end>>)")
-ANSI_BACKGROUND = re.compile("(?P<begin>%X<#)(?P<hex>[a-fA-F0-9]{6})(?P<end>>)")
 ANSI_CODES = re.compile(r"(?P<ansi>\\033\[[0-9]{2};2;[0-9]{1,3};[0-9]{1,3};[0-9]{1,3}m)")
-ANSI_CLEAR_MUSH = re.compile("%xn")
+ANSI_MARKUP = re.compile("%(?:(?P<layer>[xX])<#(?P<hex>[a-fA-F0-9]{6})>|xn)")
 ANSI_CLEAR = '\033[0m'
 
+# for the "!r" bit of a {field!r}
+CONVERSIONS = {None: lambda value: value, "s": str, "r": repr, "a": ascii}
+
+# nearest xterm cube level for every possible channel value, worked out once
+# instead of on every call. Ties round up.
+ROUND_LUT = [min(ANSI_ROUND, key=lambda level: (abs(level - value), -level)) for value in range(256)]
+
+# the 6 grey-ish steps of the cube are coarse, so xterm adds a 24 step ramp
+GREY_RAMP = [8 + 10 * i for i in range(24)]
+
+# the standard xterm values for the 16 basic colours, in SGR order
+ANSI_16 = ["000000", "cd0000", "00cd00", "cdcd00", "0000ee", "cd00cd", "00cdcd", "e5e5e5",
+           "7f7f7f", "ff0000", "00ff00", "ffff00", "5c5cff", "ff00ff", "00ffff", "ffffff"]
+
+COLOUR_DEPTHS = ["truecolor", "256", "16"]
+
 def hex_parser(hex):
   rgb_hex = [hex[:2], hex[2:4], hex[4:]]
   
@@ -24,41 +44,107 @@ def ansi(hex, text, background=False):
 def strip_ansi(text):
   return ANSI_CODES.sub("", text)
 
-def re_ansi(match_object):
-  if 'x' in match_object.group('begin'):
-    return ansi(match_object.group('hex'), '')
+def hex_round(hex):
+  return "{:02X}{:02X}{:02X}".format(*[ROUND_LUT[sub_hex] for sub_hex in hex_parser(hex)])
+
+
+def colour_distance(rgb_1, rgb_2):
+  return sum([(x - y) ** 2 for x, y in zip(rgb_1, rgb_2)])
+
+
+def detect_depth():
+  if environ.get("COLORTERM", "").lower() in ("truecolor", "24bit"):
+    return "truecolor"
+
+  elif "256" in environ.get("TERM", ""):
+    return "256"
+
+  return "16"
+
+
+# the parameters of an SGR code (the bit between "\033[" and "m") for a colour
+# at the given depth
+def colour_code(hex, background=False, depth="truecolor"):
+  rgb = hex_parser(hex)
+
+  if depth == "truecolor":
+    return f"{48 if background else 38};2;{rgb[0]};{rgb[1]};{rgb[2]}"
+
+  elif depth == "256":
+    cube = [ROUND_LUT[c] for c in rgb]
+    index = 16 + 36 * ANSI_ROUND.index(cube[0]) + 6 * ANSI_ROUND.index(cube[1]) + ANSI_ROUND.index(cube[2])
+    grey = min(GREY_RAMP, key=lambda level: colour_distance(rgb, (level,) * 3))
+
+    if colour_distance(rgb, (grey,) * 3) < colour_distance(rgb, cube):
+      index = 232 + GREY_RAMP.index(grey)
+
+    return f"{48 if background else 38};5;{index}"
 
   else:
-    return ansi(match_object.group('hex'), '', True)
+    index = min(range(16), key=lambda i: colour_distance(rgb, hex_parser(ANSI_16[i])))
+    base = 40 if background else 30
 
+    return str(base + index if index < 8 else base + 60 + index - 8)
 
-def hex_round(hex):
-  rgb_hex = hex_parser(hex)
-  rounded_hex = []
 
-  for sub_hex in rgb_hex:
-    if sub_hex == 0 or sub_hex == 255:
-      rounded_hex.append(sub_hex)
-      continue
+# maps every colour we're going to draw with to its code up front, so
+# painting a cell is just a dictionary lookup. Cached, as every game drawing
+# with the same colours can share the one table.
+@lru_cache(maxsize=None)
+def colour_table(colours, depth="truecolor"):
+  return {(hex, background): colour_code(hex, background, depth)
+          for hex in colours for background in (False, True)}
 
-    value_list = sorted(ANSI_ROUND.copy() + [sub_hex])
-    value_index = value_list.index(sub_hex)
-    triplet = value_list[value_index - 1:value_index + 2]
 
-    if triplet[1] - triplet[0] >= triplet[2] - triplet[1]:
-      rounded_hex.append(triplet[2])
+# Markup parsed once into literal text and {fields}, so drawing it again is
+# just a join. Fields are left alone unless asked for, as most text with
+# markup in it doesn't expect its braces to mean anything.
+class Template:
+  def __init__(self, text, fields=False, depth="truecolor"):
+    codes = []
+    position = 0
 
-    else:
-      rounded_hex.append(triplet[0])
+    for match in ANSI_MARKUP.finditer(text):
+      codes.append(text[position:match.start()])
 
-  return "{:02X}{:02X}{:02X}".format(*rounded_hex)
+      if match.group("layer") is None:
+        codes.append(ANSI_CLEAR)
 
+      else:
+        codes.append(f"\033[{colour_code(match.group('hex'), match.group('layer') == 'X', depth)}m")
+
+      position = match.end()
+
+    self.text = "".join(codes) + text[position:]
+    self.segments = []
+
+    if not fields:
+      return
+
+    for literal, field, spec, conversion in Formatter().parse(self.text):
+      if literal:
+        self.segments.append(literal)
+
+      if field is not None:
+        self.segments.append((field, spec, CONVERSIONS[conversion]))
 
-def parse_code(text):
-  temp_text = re.sub(ANSI_FOREGROUND, re_ansi, text)
-  temp_text = re.sub(ANSI_BACKGROUND, re_ansi, temp_text)
 
-  return re.sub(ANSI_CLEAR_MUSH, ANSI_CLEAR, temp_text)
+  def render(self, **fields):
+    if not self.segments:
+      return self.text
+
+    return "".join([segment if segment.__class__ is str
+                    else format(segment[2](fields[segment[0]]), segment[1])
+                    for segment in self.segments])
+
+
+@lru_cache(maxsize=1024)
+def compile_code(text, fields=False, depth="truecolor"):
+  return Template(text, fields=fields, depth=depth)
+
+
+def parse_code(text):
+  return compile_code(text).render()
 
 def colour_gradient(hex_1, hex_2, steps):
   rgb_hex_1 = hex_parser(hex_1)
@@ -118,6 +204,24 @@ def parse_moniker(moniker):
 
   return name, colour_scheme
 
+# a colour scheme built from the colours of a moniker, e.g.
+# "%x<#1b0c41>em%x<#cf4446>be%x<#fb9b06>rs", smoothly stretched out to size
+# colours. Cached, since the gradient code rebuilds everything from scratch.
+@lru_cache(maxsize=None)
+def gradient_palette(moniker, size=7):
+  _, colour_scheme = parse_moniker(moniker)
+  anchors = [(hex, 1) for hex, _ in colour_scheme]
+
+  if len(anchors) == 1:
+    return tuple(anchors[0][0] for _ in range(size))
+
+  # no room for anything in between, so just pick out anchors evenly, ends
+  # included
+  if len(anchors) >= size:
+    return tuple(anchors[round(i * (len(anchors) - 1) / (size - 1))][0] for i in range(size))
+
+  return tuple(multi_gradient(anchors, size))
+
 def validate_hex(hex):
   try:
     if len(hex) != 6:
@@ -131,6 +235,12 @@ def validate_hex(hex):
   return True
 
 def title(colour_scheme, text, width, smooth=True):
+  return compiled_title(tuple(colour_scheme), text, width, smooth)
+
+
+# titles get redrawn a lot and hardly ever change, so only build each one once
+@lru_cache(maxsize=256)
+def compiled_title(colour_scheme, text, width, smooth=True):
   gradient = multi_gradient(colour_scheme, width, smooth=smooth)
   buffer = width - len(text)
   title_text = (" " * (buffer // 2)
@@ -144,3 +254,99 @@ def title(colour_scheme, text, width, smooth=True):
     + ANSI_CLEAR
     + "\n"
     )
+
+
+# Keeps track of what the terminal's colours currently are, so a colour code
+# only gets sent when it actually changes. Most of the field is the same colour,
+# so this cuts a full paint down to a fraction of what it used to be.
+class Encoder:
+  def __init__(self, stream=None, depth="truecolor"):
+    self.stream      = stream or sys.stdout
+    self.depth       = depth
+    self.buffer      = []
+    self.codes       = {}
+    self.foreground  = None
+    self.background  = None
+    self.paint_bytes = 0
+    self.total_bytes = 0
+
+
+  def code(self, hex, background=False):
+    try:
+      return self.codes[hex, background]
+
+    except KeyError:
+      code = self.codes[hex, background] = colour_code(hex, background, self.depth)
+
+      return code
+
+
+  def preload(self, colours):
+    self.codes.update(colour_table(tuple(colours), self.depth))
+
+
+  def reset(self):
+    self.buffer.append(ANSI_CLEAR)
+    self.foreground = None
+    self.background = None
+
+
+  # forgets everything written since the last flush, for when it's about to be
+  # painted over anyway
+  def discard(self):
+    self.buffer.clear()
+    self.foreground = None
+    self.background = None
+
+
+  # for anything that doesn't change the colours (cursor movement, newlines)
+  def raw(self, text):
+    self.buffer.append(text)
+
+
+  def move(self, x, y):
+    self.buffer.append(f"\033[{y + 1};{x + 1}H")
+
+
+  def style(self, foreground, background):
+    codes = []
+
+    if background != self.background:
+      codes.append("49" if background is None else self.code(background, True))
+
+    if foreground != self.foreground:
+      codes.append("39" if foreground is None else self.code(foreground))
+
+    if codes:
+      self.buffer.append(f"\033[{';'.join(codes)}m")
+      self.foreground = foreground
+      self.background = background
+
+
+  def text(self, foreground, background, text):
+    # the foreground colour of a blank never shows, so leave it be
+    if not text.strip():
+      foreground = self.foreground
+
+    self.style(foreground, background)
+    self.buffer.append(text)
+
+
+  # cells are (foreground, background, character); runs of the same colours
+  # get fused into one piece of text
+  def cells(self, cells):
+    for (foreground, background), run in groupby(cells, key=itemgetter(0, 1)):
+      self.text(foreground, background, "".join([cell[2] for cell in run]))
+
+
+  def flush(self):
+    frame = "".join(self.buffer)
+    self.buffer.clear()
+
+    self.stream.write(frame)
+    self.stream.flush()
+
+    self.paint_bytes  = len(frame.encode())
+    self.total_bytes += self.paint_bytes
+
+    return self.paint_bytes
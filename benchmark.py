@@ -0,0 +1,130 @@
+#!/Library/Frameworks/Python.framework/Versions/3.7/bin/python3.7
+
+# Times how field generation scales with the number of processes.
+#
+#   python3 benchmark.py -a 4000x2000
+#
+# prints how long a field that size takes on 1, 2, ... processes, and how much
+# faster each is than one process.
+#
+#   python3 benchmark.py --games 200 --threads 16
+#
+# plays 200 games with made-up keypresses, all at once on 16 threads, and
+# checks every one of them ends up exactly the same as it does played alone.
+
+import hashlib
+from io import StringIO
+from os import cpu_count
+from time import perf_counter
+from random import Random
+from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
+
+from tiled import Tiled_Field
+from ansi import Encoder
+from sweeper import Minefield, pygame, number_colours, COLOUR_SCHEMES
+
+# losing gets undone, so every game gets all its keys
+STRESS_KEYS = [pygame.K_w, pygame.K_a, pygame.K_s, pygame.K_d] * 4 + [
+  pygame.K_KP5, pygame.K_f, pygame.K_KP_ENTER, pygame.K_SPACE, pygame.K_t,
+  pygame.K_p, pygame.K_z, pygame.K_y, pygame.K_c]
+
+
+
+def scaling(width, height, bombs, jobs, repeats):
+  print(f"{width}x{height}, {bombs} bombs ({width * height / 1e6:.1f} megaspaces)")
+  print(f"{'jobs':>4}  {'seconds':>8}  {'speedup':>7}")
+
+  baseline = None
+
+  for job_count in jobs:
+    times = []
+
+    for seed in range(repeats):
+      start = perf_counter()
+      Tiled_Field(width, height, bombs, jobs=job_count, seed=seed).generate()
+      times.append(perf_counter() - start)
+
+    best = min(times)
+    baseline = baseline or best
+
+    print(f"{job_count:>4}  {best:>8.2f}  {baseline / best:>6.2f}x  {'#' * round(10 * baseline / best)}")
+
+
+
+# Everything about how a game went: the board, what's been said, and every byte
+# it drew. Each game gets a different colour scheme, so any mixing up of
+# schemes between games shows up too.
+def play(seed, width, height, presses):
+  buffer = StringIO()
+  schemes = sorted(COLOUR_SCHEMES)
+  minefield = Minefield(width=width,
+                        height=height,
+                        screen=Encoder(buffer),
+                        colours=number_colours(schemes[seed % len(schemes)]),
+                        seed=seed)
+  minefield.generate_game()
+  keys = Random(seed)
+
+  for _ in range(presses):
+    minefield.press_all([keys.choice(STRESS_KEYS) for _ in range(keys.randint(1, 4))])
+
+    if not minefield.playing:
+      minefield.press(pygame.K_z)
+
+    minefield.show_status_line()
+
+  return (hashlib.sha1(repr(minefield.player_grid).encode()).hexdigest(),
+          minefield.flags,
+          minefield.status_line.text,
+          hashlib.sha1(buffer.getvalue().encode()).hexdigest())
+
+
+def stress(games, threads, width, height, presses):
+  seeds = range(games)
+
+  start = perf_counter()
+  serial = [play(seed, width, height, presses) for seed in seeds]
+  serial_time = perf_counter() - start
+
+  start = perf_counter()
+
+  with ThreadPoolExecutor(threads) as pool:
+    threaded = list(pool.map(lambda seed: play(seed, width, height, presses), seeds))
+
+  threaded_time = perf_counter() - start
+
+  mismatches = [seed for seed, (alone, together) in enumerate(zip(serial, threaded)) if alone != together]
+
+  print(f"{games} games of {width}x{height}, {presses} frames of keys each")
+  print(f"  one at a time:      {serial_time:.2f}s")
+  print(f"  {threads:>3} threads:       {threaded_time:.2f}s")
+  print(f"  differing games:    {len(mismatches)}{' ' + str(mismatches[:10]) if mismatches else ''}")
+
+  return not mismatches
+
+
+
+if __name__ == "__main__":
+  argparser = ArgumentParser(description="Benchmarks minefield generation, or lots of games at once.")
+
+  argparser.add_argument("-a", "--area", help="Area of the field (default: 4000x2000, or 60x20 for --games).", metavar="<int width>x<int height>", default=None)
+  argparser.add_argument("-B", "--bomb_percent", help="Bombs as a percentage of spaces on the field (default 0.2).", metavar="<float between 0-1>", type=float, default=0.2)
+  argparser.add_argument("-j", "--jobs", help="Most processes to try (default: every core).", metavar="<int>", type=int, default=cpu_count())
+  argparser.add_argument("-r", "--repeats", help="Runs per process count; the best one counts (default: 3).", metavar="<int>", type=int, default=3)
+  argparser.add_argument("-g", "--games", help="Instead, plays this many games at once on threads and checks them against playing them one at a time.", metavar="<int>", type=int, default=0)
+  argparser.add_argument("-t", "--threads", help="Threads to play the games on (default: 8).", metavar="<int>", type=int, default=8)
+  argparser.add_argument("-p", "--presses", help="Frames of keys per game (default: 300).", metavar="<int>", type=int, default=300)
+
+  args = argparser.parse_args()
+
+  if args.games:
+    width, height = [int(i) for i in (args.area or "60x20").split("x")]
+
+    if not stress(args.games, args.threads, width, height, args.presses):
+      exit(1)
+
+  else:
+    width, height = [int(i) for i in (args.area or "4000x2000").split("x")]
+
+    scaling(width, height, int(width * height * args.bomb_percent), range(1, args.jobs + 1), args.repeats)
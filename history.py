@@ -0,0 +1,102 @@
+#!/Library/Frameworks/Python.framework/Versions/3.7/bin/python3.7
+
+# Undo and redo for the player's side of the board.
+#
+# Rather than a copy of the board per step, each step only remembers the spaces
+# that changed in it (what they were and what they became), along with the
+# flags, cursor, status line and whether the game was still going on either
+# side of it. Every step shares the rest of the board with the one real
+# player_grid, so a step costs memory in proportion to what changed: about
+# half a kilobyte for a flag, plus about 150 bytes for every space a flood fill
+# opens. A copy of a 200x60 player_grid would be about 100 KB.
+
+from sys import getsizeof
+
+
+
+class Step:
+  def __init__(self, before):
+    self.before  = before
+    self.after   = None
+    self.changes = {}
+    self.repaint = set()
+
+
+  def size(self):
+    return (getsizeof(self)
+            + getsizeof(self.changes)
+            + sum([getsizeof(cell) + getsizeof(change) for cell, change in self.changes.items()])
+            + getsizeof(self.repaint))
+
+
+
+# With max_steps, the oldest steps get forgotten once there are that many, so a
+# long game's history can't grow forever.
+class History:
+  def __init__(self, max_steps=None):
+    self.max_steps = max_steps
+    self.steps     = []
+    self.position  = 0
+    self.current   = None
+    self.applying  = False
+
+
+  # a step covers one keypress; begin and end it with the state around it
+  def begin(self, state):
+    self.current = Step(state)
+
+
+  def record(self, x, y, old, new):
+    if self.current is None or self.applying:
+      return
+
+    # the first old value and the last new one are all that matter
+    first, _ = self.current.changes.get((x, y), (old, new))
+    self.current.changes[x, y] = (first, new)
+
+
+  # spaces drawn over without changing (KABOOM), to be redrawn on undo
+  def smudge(self, spaces):
+    if self.current is not None and not self.applying:
+      self.current.repaint.update(spaces)
+
+
+  # returns the finished step, if anything changed in it
+  def end(self, state):
+    step, self.current = self.current, None
+
+    if step is None or not step.changes:
+      return None
+
+    step.after = state
+
+    # a new step means the old future's gone
+    del self.steps[self.position:]
+    self.steps.append(step)
+    self.position += 1
+
+    if self.max_steps is not None and len(self.steps) > self.max_steps:
+      del self.steps[0]
+      self.position -= 1
+
+    return step
+
+
+  def undo(self):
+    if self.position == 0:
+      return None
+
+    self.position -= 1
+    return self.steps[self.position]
+
+
+  def redo(self):
+    if self.position == len(self.steps):
+      return None
+
+    self.position += 1
+    return self.steps[self.position - 1]
+
+
+  def size(self):
+    return sum([step.size() for step in self.steps])
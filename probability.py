@@ -0,0 +1,521 @@
+#!/Library/Frameworks/Python.framework/Versions/3.7/bin/python3.7
+
+# Works out how likely every hidden space is to be a mine, given what the
+# player can see.
+#
+# Every revealed number next to hidden spaces is a constraint: its hidden
+# neighbours hold (number - flags next to it) mines. Hidden spaces tied
+# together by constraints form a component, and each component's possible
+# layouts get counted on their own, by how many mines they use. Those then get
+# combined, with every hidden space not next to a number (the interior)
+# soaking up the rest of the bombs. Flags are trusted to be mines.
+#
+# A component's count only depends on its constraints, so it's cached by them;
+# a reveal only recounts the components around it.
+
+from math import lgamma, exp
+from operator import mul
+
+
+
+# components get counted along a line through their cells, keeping track of
+# how many mines each number that's been started on still needs. If that gets
+# too tangled to keep track of, the component gets a rough guess instead.
+MAX_STATES = 20000
+
+# ...or if more than this many numbers would be partly counted at once, which
+# is caught before any counting starts. Nothing that wide ever finishes, unless
+# there are too few cells on one side or the other for it to matter.
+MAX_WIDTH = 9
+
+# ...and the same if counting would take too long overall. Carrying a state
+# from one cell to the next costs a unit for every term of its polynomial and
+# every number it's keeping track of. This is all done mid-frame, so the
+# budget is about a twentieth of a second, shared by every component a refresh
+# counts; whichever don't fit get guessed at until a later refresh.
+MAX_WORK = 150000
+
+# anything this much less likely than the most likely number of mines doesn't
+# change the answer
+NEGLIGIBLE = 1e-16
+
+
+
+def log_comb(n, k):
+  return lgamma(n + 1) - lgamma(k + 1) - lgamma(n - k + 1)
+
+
+# distributions are (offset, weights), weights[i] being how likely offset + i
+# mines is. Scaled so the biggest weight is 1, and trimmed of the negligible.
+def trim(offset, weights):
+  top = max(weights, default=0)
+
+  if top <= 0:
+    return offset, []
+
+  weights = [weight / top for weight in weights]
+  start = 0
+  end = len(weights)
+
+  while weights[start] < NEGLIGIBLE:
+    start += 1
+
+  while weights[end - 1] < NEGLIGIBLE:
+    end -= 1
+
+  return offset + start, weights[start:end]
+
+
+def convolve(first, second):
+  offset_1, weights_1 = first
+  offset_2, weights_2 = second
+  weights = [0.0] * (len(weights_1) + len(weights_2) - 1) if weights_1 and weights_2 else []
+
+  for i, weight_1 in enumerate(weights_1):
+    for j, weight_2 in enumerate(weights_2):
+      weights[i + j] += weight_1 * weight_2
+
+  return trim(offset_1 + offset_2, weights)
+
+
+# sum of weights[i] * distribution's weight for at + i mines, over every i
+def overlap(weights, distribution, at):
+  offset, other = distribution
+  shift = at - offset
+  low = max(0, -shift)
+  high = min(len(weights), len(other) - shift)
+
+  return sum(map(mul, weights[low:high], other[shift + low:shift + high])) if low < high else 0.0
+
+
+# which numbers each cell is next to
+def touching_cells(constraints):
+  touching = {}
+
+  for i, (cells, _) in enumerate(constraints):
+    for cell in cells:
+      touching.setdefault(cell, []).append(i)
+
+  return touching
+
+
+# cells in breadth-first order from the loneliest one, so only a few numbers
+# are ever partly counted at once; for the usual long thin frontier, a couple
+def ordered_cells(constraints, touching=None):
+  touching = touching or touching_cells(constraints)
+  order = []
+  seen = set()
+
+  for start in sorted(touching, key=lambda cell: len(touching[cell])):
+    if start in seen:
+      continue
+
+    seen.add(start)
+    frontier = [start]
+
+    while frontier:
+      order.extend(frontier)
+      next_frontier = []
+
+      for cell in frontier:
+        for c in touching[cell]:
+          for neighbour in constraints[c][0]:
+            if neighbour not in seen:
+              seen.add(neighbour)
+              next_frontier.append(neighbour)
+
+      frontier = next_frontier
+
+  return order, touching
+
+
+def add_to(polynomial, other, shift=0, times=1):
+  for k, count in other.items():
+    polynomial[k + shift] = polynomial.get(k + shift, 0) + count * times
+
+
+class Too_Tangled(Exception):
+  pass
+
+
+class Out_Of_Time(Too_Tangled):
+  pass
+
+
+class Budget:
+  def __init__(self, units=MAX_WORK):
+    self.units = units
+
+
+  def spend(self, units):
+    self.units -= units
+
+    if self.units < 0:
+      raise Out_Of_Time
+
+
+# Counts every layout of a component, by number of mines, and how many of those
+# have a mine in each cell. Goes through the cells in order twice: forwards,
+# tracking how many mines each open number still needs, and backwards,
+# tracking how many each open number has been given. Where the two meet at a
+# cell, matching states join up into every complete layout.
+#
+# order is what ordered_cells gives back, if it's already been worked out.
+def count_layouts(constraints, order=None, budget=None):
+  cells, touching = order or ordered_cells(constraints)
+  budget = budget or Budget()
+  n = len(cells)
+  position = {cell: i for i, cell in enumerate(cells)}
+  members = [touching[cell] for cell in cells]
+
+  # how many of a number's cells come before cell t, for each number cell t is in
+  before = [{} for _ in range(n)]
+  starts = [[] for _ in range(n)]
+  ends = [[] for _ in range(n)]
+
+  for c, (constraint_cells, _) in enumerate(constraints):
+    positions = sorted(position[cell] for cell in constraint_cells)
+    starts[positions[0]].append(c)
+    ends[positions[-1]].append(c)
+
+    for i, t in enumerate(positions):
+      before[t][c] = i
+
+  # open_[t]: the numbers with cells on both sides of the gap before cell t
+  open_ = [[]]
+
+  for t in range(n):
+    open_.append(sorted((set(open_[-1]) | set(starts[t])) - set(ends[t])))
+
+  if any([len(open_[t]) > MAX_WIDTH and 2 ** min(t, n - t) > MAX_STATES for t in range(n + 1)]):
+    raise Too_Tangled
+
+  spend = budget.spend
+
+  def check(states):
+    if len(states) > MAX_STATES:
+      raise Too_Tangled
+
+  forwards = [{(): {0: 1}}]
+
+  for t in range(n):
+    states = {}
+
+    for state, polynomial in forwards[t].items():
+      spend(len(polynomial) + len(state))
+      needs = dict(zip(open_[t], state))
+
+      for mine in (0, 1):
+        possible = True
+        new_needs = {}
+
+        for c in members[t]:
+          need = needs.get(c, constraints[c][1]) - mine
+
+          if need < 0 or need > len(constraints[c][0]) - before[t][c] - 1:
+            possible = False
+            break
+
+          new_needs[c] = need
+
+        if possible:
+          new_state = tuple([new_needs.get(c, needs.get(c)) for c in open_[t + 1]])
+          add_to(states.setdefault(new_state, {}), polynomial, mine)
+
+    check(states)
+    forwards.append(states)
+
+  backwards = {(): {0: 1}}
+  total = {}
+  mine_counts = [None] * n
+
+  for t in range(n - 1, -1, -1):
+    states = {}
+    mined = {}
+
+    for state, polynomial in backwards.items():
+      spend(len(polynomial) + len(state))
+      given = dict(zip(open_[t + 1], state))
+
+      for mine in (0, 1):
+        possible = True
+        new_given = {}
+
+        for c in members[t]:
+          count = given.get(c, 0) + mine
+
+          if count > constraints[c][1] or count < constraints[c][1] - before[t][c]:
+            possible = False
+            break
+
+          new_given[c] = count
+
+        if possible:
+          new_state = tuple([new_given.get(c, given.get(c)) for c in open_[t]])
+          add_to(states.setdefault(new_state, {}), polynomial, mine)
+
+          if mine:
+            add_to(mined.setdefault(new_state, {}), polynomial, mine)
+
+    check(states)
+    backwards = states
+
+    # the forward states before cell t need exactly what the backward states
+    # from cell t on give
+    mine_counts[t] = {}
+
+    for state, polynomial in mined.items():
+      forward = forwards[t].get(state, {})
+      spend(len(polynomial) * len(forward))
+
+      for k, count in forward.items():
+        add_to(mine_counts[t], polynomial, k, count)
+
+  add_to(total, backwards.get((), {}))
+
+  cell_counts = {k: [mine_counts[i].get(k, 0) for i in range(n)] for k in total}
+
+  return cells, total, cell_counts
+
+
+# for components too big to count: every cell gets the average density of the
+# numbers around it, and the component uses however many mines that adds up to
+def guess_layouts(constraints, touching=None):
+  touching = touching or touching_cells(constraints)
+  cells = list(touching)
+  densities = [sum([max(0, constraints[c][1]) / len(constraints[c][0]) for c in touching[cell]]) / len(touching[cell])
+               for cell in cells]
+  mines = round(sum(densities))
+
+  return cells, {mines: 1}, {mines: densities}
+
+
+
+class Probability_Engine:
+  def __init__(self, minefield, hidden, flag):
+    self.minefield     = minefield
+    self.hidden_marker = hidden
+    self.flag_marker   = flag
+    self.constraints   = {}
+    self.hidden        = set()
+    self.components    = {}
+    self.tangled       = {}
+    self.pending       = set()
+    self.dirty         = {(x, y) for x in range(minefield.width) for y in range(minefield.height)}
+    self.probabilities = {}
+    self.interior      = 0
+
+
+  def touch(self, x, y):
+    self.dirty.add((x, y))
+
+
+  def probability(self, x, y):
+    return self.probabilities.get((x, y), self.interior)
+
+
+  # whether refresh() has anything to do: something's changed, or there are
+  # components still waiting for their turn to be counted
+  def stale(self):
+    return bool(self.dirty or self.pending)
+
+
+  def refresh(self):
+    if not self.stale():
+      return
+
+    grid = self.minefield.player_grid
+    recheck = set()
+
+    for x, y in self.dirty:
+      if grid[y][x] == self.hidden_marker:
+        self.hidden.add((x, y))
+
+      else:
+        self.hidden.discard((x, y))
+
+      recheck.add((x, y))
+      recheck.update(self.minefield.adjacencies(x, y))
+
+    self.dirty.clear()
+
+    for x, y in recheck:
+      self.constraints.pop((x, y), None)
+
+      if not isinstance(grid[y][x], int):
+        continue
+
+      adjacent_spaces = self.minefield.adjacencies(x, y)
+      cells = tuple(sorted(space for space in adjacent_spaces if space in self.hidden))
+      flags = len([1 for adjacent_x, adjacent_y in adjacent_spaces if grid[adjacent_y][adjacent_x] == self.flag_marker])
+
+      if cells:
+        self.constraints[x, y] = (cells, grid[y][x] - flags)
+
+    self.solve()
+
+
+  def split(self):
+    parents = {}
+
+    def root(cell):
+      while parents[cell] != cell:
+        parents[cell] = parents[parents[cell]]
+        cell = parents[cell]
+
+      return cell
+
+    for cells, _ in self.constraints.values():
+      for cell in cells:
+        parents.setdefault(cell, cell)
+
+      for cell in cells[1:]:
+        parents[root(cell)] = root(cells[0])
+
+    components = {}
+
+    for constraint in set(self.constraints.values()):
+      components.setdefault(root(constraint[0][0]), []).append(constraint)
+
+    return [tuple(sorted(constraints)) for constraints in components.values()]
+
+
+  # A component that's mostly the same cells as one that was too tangled last
+  # time (a reveal or a flag having only nibbled at it) won't be any less
+  # tangled now, so there's no point spending the frame finding that out again.
+  def gave_up_on(self, cells, tangled_cells):
+    shared = {}
+
+    for cell in cells:
+      if cell in tangled_cells:
+        old = tangled_cells[cell]
+        shared[old] = shared.get(old, 0) + 1
+
+    return any([4 * count >= 3 * len(old) for old, count in shared.items()])
+
+
+  def count(self):
+    components = {}
+    tangled = {}
+    pending = set()
+    tangled_cells = {cell: cells for cells in self.tangled.values() for cell in cells}
+    uncounted = []
+
+    for constraints in self.split():
+      if constraints in self.components and constraints not in self.pending:
+        components[constraints] = self.components[constraints]
+
+        if constraints in self.tangled:
+          tangled[constraints] = self.tangled[constraints]
+
+      else:
+        uncounted.append(constraints)
+
+    # the smallest first, as they're the likeliest to fit in what's left
+    budget = Budget()
+
+    for constraints in sorted(uncounted, key=len):
+      touching = touching_cells(constraints)
+      cells = frozenset(touching)
+
+      if self.gave_up_on(cells, tangled_cells):
+        tangled[constraints] = cells
+
+      elif budget.units <= 0:
+        pending.add(constraints)
+
+      else:
+        whole_budget = budget.units == MAX_WORK
+
+        try:
+          components[constraints] = count_layouts(constraints, ordered_cells(constraints, touching), budget)
+          continue
+
+        except Out_Of_Time:
+          if whole_budget:
+            tangled[constraints] = cells
+
+          else:
+            pending.add(constraints)
+
+        except Too_Tangled:
+          tangled[constraints] = cells
+
+      components[constraints] = guess_layouts(constraints, touching)
+
+    # only keep around what's still on the board
+    self.components = components
+    self.tangled = tangled
+    self.pending = pending
+
+    return components
+
+
+  def solve(self):
+    components = self.count()
+    self.probabilities = {}
+
+    # numbers that can't all be right (too many flags, say) have nothing useful
+    # to say, so leave their cells out
+    layouts = [layout for layout in components.values() if layout[1]]
+    frontier = sum([len(cells) for cells, _, _ in layouts])
+    interior = len(self.hidden) - frontier
+    remaining = self.minefield.bombs - self.minefield.flags
+
+    # counts can get huge, so only how they compare to each other is kept
+    scales = [max(counts.values()) for _, counts, _ in layouts]
+    distributions = [trim(min(counts), [counts.get(k, 0) / scale for k in range(min(counts), max(counts) + 1)])
+                     for (_, counts, _), scale in zip(layouts, scales)]
+
+    # how many mines the components before each one are likely to use, between
+    # them (prefixes[c] being the ones before c)
+    prefixes = [(0, [1.0])]
+
+    for distribution in distributions:
+      prefixes.append(convolve(prefixes[-1], distribution))
+
+    # how likely the interior is to hold the rest of the bombs, if the frontier
+    # has k. Scaled against the most likely k that could actually happen, as
+    # anything else is too small to matter (and too small for a float).
+    lowest = sum([min(counts) for _, counts, _ in layouts])
+    highest = sum([max(counts) for _, counts, _ in layouts])
+    interior_weights = [log_comb(interior, remaining - k) if 0 <= remaining - k <= interior else None
+                        for k in range(lowest, highest + 1)]
+    most_likely = max([weight for weight in interior_weights if weight is not None], default=None)
+
+    if most_likely is None:
+      self.interior = 0
+      return
+
+    # after[c] is how likely the layouts of the components from c on are
+    # (interior included), given m mines used before c. Only worked out for the
+    # m that prefixes[c] says could happen, so it stays narrow however many
+    # components there are.
+    after = [None] * (len(layouts) + 1)
+    after[-1] = (lowest, [0.0 if weight is None else exp(weight - most_likely) for weight in interior_weights])
+
+    for c in range(len(layouts) - 1, -1, -1):
+      offset, weights = distributions[c]
+      start, prefix = prefixes[c]
+      after[c] = (start, [overlap(weights, after[c + 1], m + offset) for m in range(start, start + len(prefix))])
+
+    expected = 0.0
+
+    for c, ((cells, counts, cell_counts), scale) in enumerate(zip(layouts, scales)):
+      before = prefixes[c]
+
+      # how likely this component is to use k mines, everything else considered
+      chances = {}
+
+      for k in counts:
+        chances[k] = overlap(before[1], after[c + 1], before[0] + k)
+
+      weight_sum = sum([counts[k] / scale * chances[k] for k in counts])
+
+      if weight_sum > 0:
+        for i, cell in enumerate(cells):
+          self.probabilities[cell] = sum([cell_counts[k][i] / scale * chances[k] for k in counts]) / weight_sum
+
+        expected += sum([k * counts[k] / scale * chances[k] for k in counts]) / weight_sum
+
+    self.interior = max(0.0, min(1.0, (remaining - expected) / interior)) if interior > 0 else 0
@@ -0,0 +1,402 @@
+#!/Library/Frameworks/Python.framework/Versions/3.7/bin/python3.7
+
+# Hosts lots of games at once from one process. Anything that can send
+# keystrokes down a socket works as a client:
+#
+#   python3 server.py -p 2323
+#   stty raw -echo; nc localhost 2323; stty sane
+#
+# or telnet, with --telnet so it gets told to send every key as it's pressed.
+# Type the number of a running game instead of just hitting enter to watch it.
+#
+#   python3 server.py --load 300 -p 2323
+#
+# throws a pile of fake players at a running server to see how it copes.
+
+
+
+import asyncio
+from io import StringIO
+from itertools import groupby
+from random import choice
+from logging import basicConfig, INFO, info
+from argparse import ArgumentParser
+
+from ansi import ANSI_CLEAR, COLOUR_DEPTHS, Encoder
+from sweeper import (Minefield, Game_End, pygame, number_colours,
+                     DEFAULT_BOMB_PERCENTAGE, DEFAULT_COLOUR_SCHEME)
+
+
+
+KEYS = {
+  b"w": pygame.K_w,
+  b"s": pygame.K_s,
+  b"a": pygame.K_a,
+  b"d": pygame.K_d,
+  b"5": pygame.K_KP5,
+  b"f": pygame.K_f,
+  b"\r": pygame.K_KP_ENTER,
+  b"\n": pygame.K_KP_ENTER,
+  b" ": pygame.K_SPACE,
+  b"8": pygame.K_KP8,
+  b"2": pygame.K_KP2,
+  b"4": pygame.K_KP4,
+  b"6": pygame.K_KP6,
+  b"r": pygame.K_r,
+  b"t": pygame.K_t,
+  b"p": pygame.K_p,
+  b"z": pygame.K_z,
+  b"y": pygame.K_y,
+  b"c": pygame.K_c,
+  b"q": pygame.K_ESCAPE,
+  b"\x1b": pygame.K_ESCAPE,
+  # arrow keys
+  b"\x1b[A": pygame.K_w,
+  b"\x1b[B": pygame.K_s,
+  b"\x1b[D": pygame.K_a,
+  b"\x1b[C": pygame.K_d}
+
+# there's no holding a key down over a socket, so 0 highlights until the next key
+HIGHLIGHT = b"0"
+
+# telnet: IAC WILL ECHO, IAC WILL SUPPRESS-GO-AHEAD, i.e. "send me every key"
+TELNET_SETUP = bytes([255, 251, 1, 255, 251, 3])
+IAC = 255
+SB  = 250
+SE  = 240
+
+# how far a viewer can fall behind before they stop getting every frame and
+# just get a fresh copy of the board once they catch up
+BACKLOG_LIMIT = 1 << 16
+
+# how many moves back each game can be undone, so a long game doesn't keep
+# using more memory
+HISTORY_LIMIT = 200
+
+WELCOME = (ANSI_CLEAR + "\033[2J\033[H"
+  + "Games running: {games}\r\n"
+  + "Hit enter for a new game, or type the number of one to watch it: ")
+
+
+
+def keys(data):
+  i = 0
+
+  while i < len(data):
+    if data[i] == IAC:
+      # telnet negotiation, which we don't care about
+      if i + 1 < len(data) and data[i + 1] == SB:
+        end = data.find(bytes([IAC, SE]), i)
+        i = len(data) if end == -1 else end + 2
+
+      else:
+        i += 3
+
+      continue
+
+    if data[i:i + 3] in KEYS:
+      yield data[i:i + 3]
+      i += 3
+
+    else:
+      yield data[i:i + 1]
+      i += 1
+
+
+
+class Viewer:
+  def __init__(self, writer):
+    self.writer = writer
+    self.stale  = False
+
+
+  def send(self, frame, session):
+    transport = self.writer.transport
+
+    if transport.is_closing():
+      return
+
+    if transport.get_write_buffer_size() > BACKLOG_LIMIT:
+      self.stale = True
+      return
+
+    if self.stale:
+      self.stale = False
+      frame = session.snapshot()
+
+    self.writer.write(frame)
+
+
+  def close(self):
+    if not self.writer.transport.is_closing():
+      self.writer.write((ANSI_CLEAR + "\033[2J\033[H").encode())
+      self.writer.close()
+
+
+
+class Session:
+  def __init__(self, number, width, height, bombs, bomb_percentage, mode, depth, colours):
+    self.number    = number
+    self.viewers   = []
+    self.pending   = []
+    self.depth     = depth
+    self.minefield = Minefield(width=width,
+                               height=height,
+                               bombs=bombs,
+                               bomb_percentage=bomb_percentage,
+                               mode=mode,
+                               screen=Encoder(self, depth=depth),
+                               colours=colours,
+                               history_steps=HISTORY_LIMIT)
+    self.minefield.generate_game()
+    self.pending.clear()
+
+
+  # the session is the minefield's terminal, as far as its Encoder knows
+  def write(self, text):
+    self.pending.append(text)
+
+
+  def flush(self):
+    pass
+
+
+  def snapshot(self):
+    buffer = StringIO()
+    screen = Encoder(buffer, depth=self.depth)
+    self.minefield.paint(screen)
+
+    # pick up where the minefield's own screen thinks the colours are
+    screen.style(self.minefield.screen.foreground, self.minefield.screen.background)
+    screen.flush()
+
+    return buffer.getvalue().replace("\n", "\r\n").encode()
+
+
+  def attach(self, viewer):
+    self.viewers.append(viewer)
+    viewer.writer.write(self.snapshot())
+    self.minefield.show_status_line()
+    self.publish()
+
+
+  def detach(self, viewer):
+    if viewer in self.viewers:
+      self.viewers.remove(viewer)
+
+
+  # everything that came in one read, so held keys get coalesced like they are
+  # locally (see Minefield.press_all)
+  def press(self, keys):
+    for highlighting, run in groupby(keys, key=lambda key: key == HIGHLIGHT):
+      if highlighting:
+        self.minefield.highlight_adjacent()
+
+      else:
+        self.minefield.press_all([KEYS[key] for key in run if key in KEYS])
+
+    self.minefield.show_status_line()
+
+
+  def publish(self):
+    if not self.pending:
+      return
+
+    # raw terminals don't turn \n into \r\n for us
+    frame = "".join(self.pending).replace("\n", "\r\n").encode()
+    self.pending.clear()
+
+    for viewer in self.viewers:
+      viewer.send(frame, self)
+
+
+  def close(self):
+    for viewer in self.viewers:
+      viewer.close()
+
+    self.viewers.clear()
+
+
+
+class Game_Server:
+  def __init__(self, width, height, bombs, bomb_percentage, mode, depth, colours, telnet):
+    self.settings = (width, height, bombs, bomb_percentage, mode, depth, colours)
+    self.telnet   = telnet
+    self.sessions = {}
+    self.opened   = 0
+
+
+  async def handle(self, reader, writer):
+    viewer = Viewer(writer)
+
+    if self.telnet:
+      writer.write(TELNET_SETUP)
+
+    writer.write(WELCOME.format(games=len(self.sessions)).encode())
+
+    try:
+      number = await self.read_choice(reader)
+
+      if number:
+        await self.spectate(reader, viewer, int(number))
+
+      else:
+        await self.play(reader, viewer)
+
+    except (ConnectionError, ValueError, KeyError, asyncio.IncompleteReadError):
+      pass
+
+    finally:
+      viewer.close()
+
+
+  async def read_choice(self, reader):
+    number = b""
+
+    while True:
+      data = await reader.read(64)
+
+      if not data:
+        raise ConnectionError
+
+      for key in keys(data):
+        if key in (b"\r", b"\n"):
+          return number.decode()
+
+        elif key.isdigit() and len(number) < 10:
+          number += key
+
+
+  async def play(self, reader, viewer):
+    self.opened += 1
+    session = Session(self.opened, *self.settings)
+    self.sessions[session.number] = session
+    info(f"Game {session.number} started. {len(self.sessions)} running.")
+
+    try:
+      session.attach(viewer)
+
+      while True:
+        data = await reader.read(1024)
+
+        if not data:
+          break
+
+        session.press(keys(data))
+        session.publish()
+
+    except Game_End:
+      pass
+
+    finally:
+      del self.sessions[session.number]
+      session.close()
+      info(f"Game {session.number} ended. {len(self.sessions)} running.")
+
+
+  async def spectate(self, reader, viewer, number):
+    session = self.sessions[number]
+    session.attach(viewer)
+
+    try:
+      # watchers don't get a say, but can leave
+      while number in self.sessions:
+        data = await reader.read(64)
+
+        if not data or b"q" in data:
+          break
+
+    finally:
+      session.detach(viewer)
+
+
+
+# a crowd of fake players mashing keys
+async def load(connect, players, seconds, rate):
+  totals = {"keys": 0, "bytes": 0}
+
+  async def player():
+    reader, writer = await connect()
+    writer.write(b"\n")
+
+    async def drain():
+      while True:
+        data = await reader.read(1 << 16)
+
+        if not data:
+          break
+
+        totals["bytes"] += len(data)
+
+    draining = asyncio.ensure_future(drain())
+    loop = asyncio.get_event_loop()
+    end = loop.time() + seconds
+
+    while loop.time() < end:
+      writer.write(choice([b"w", b"a", b"s", b"d", b"w", b"a", b"s", b"d", b"f", b"5"]))
+      totals["keys"] += 1
+      await asyncio.sleep(1 / rate)
+
+    writer.close()
+    draining.cancel()
+
+  await asyncio.gather(*[player() for _ in range(players)])
+
+  print(f"{players} players, {seconds}s: {totals['keys']} keys sent "
+        f"({totals['keys'] / seconds:.0f}/s), {totals['bytes'] / 1024:.0f} KB received.")
+
+
+
+if __name__ == "__main__":
+  argparser = ArgumentParser(description="Hosts minesweeper games over a socket.")
+
+  argparser.add_argument("-H", "--host", help="Address to listen on (default: 127.0.0.1).", metavar="<host>", default="127.0.0.1")
+  argparser.add_argument("-p", "--port", help="Port to listen on (default: 2323).", metavar="<int>", type=int, default=2323)
+  argparser.add_argument("-u", "--unix", help="Listens on a unix socket instead.", metavar="<path>", default=None)
+  argparser.add_argument("-m", "--mode", help="Selects a mode (default or soldier).", metavar="<mode>", default="default")
+  argparser.add_argument("-a", "--area", help="Area of every field (default: 78x22).", metavar="<int width>x<int height>", default="78x22")
+  argparser.add_argument("-B", "--bomb_percent", help="Bombs per game as a percentage of spaces on the field (default 0.2).", metavar="<float between 0-1>", type=float, default=DEFAULT_BOMB_PERCENTAGE)
+  argparser.add_argument("-c", "--colour", help=f"Colour scheme of the numbers (default: {DEFAULT_COLOUR_SCHEME}).", metavar="<name>", default=DEFAULT_COLOUR_SCHEME)
+  argparser.add_argument("-d", "--depth", help="Colour depth sent to clients (default: 256).", metavar="<depth>", default="256", choices=COLOUR_DEPTHS)
+  argparser.add_argument("-t", "--telnet", help="Asks telnet clients to send each key as it's pressed.", action="store_true")
+  argparser.add_argument("-l", "--load", help="Instead of serving, connects this many fake players to a running server.", metavar="<int>", type=int, default=0)
+  argparser.add_argument("-s", "--seconds", help="How long the fake players play for (default: 10).", metavar="<int>", type=int, default=10)
+  argparser.add_argument("-r", "--rate", help="Keys per second per fake player (default: 10).", metavar="<float>", type=float, default=10)
+
+  args = argparser.parse_args()
+  loop = asyncio.get_event_loop()
+
+  if args.unix:
+    connect = lambda: asyncio.open_unix_connection(args.unix)
+
+  else:
+    connect = lambda: asyncio.open_connection(args.host, args.port)
+
+  if args.load:
+    loop.run_until_complete(load(connect, args.load, args.seconds, args.rate))
+
+  else:
+    basicConfig(
+      filename=f"server.log",
+      level=INFO,
+      format='%(asctime)s: %(message)s',
+      datefmt='%Y-%m-%d %I:%M:%S %p')
+
+    width, height = [int(i) for i in args.area.split("x")]
+
+    game_server = Game_Server(width, height, 0, args.bomb_percent, args.mode, args.depth, number_colours(args.colour), args.telnet)
+
+    if args.unix:
+      server = loop.run_until_complete(asyncio.start_unix_server(game_server.handle, args.unix))
+
+    else:
+      server = loop.run_until_complete(asyncio.start_server(game_server.handle, args.host, args.port))
+
+    try:
+      loop.run_forever()
+
+    except KeyboardInterrupt:
+      pass
+
+    finally:
+      server.close()
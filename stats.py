@@ -0,0 +1,137 @@
+#!/Library/Frameworks/Python.framework/Versions/3.7/bin/python3.7
+
+# Keeps track of how long keypresses take to show up on screen.
+#
+# A key's latency runs from when it's pulled off pygame's event queue (pygame
+# doesn't say when it was actually pressed) to when the frame that shows it
+# has been flushed to the terminal. Only the last WINDOW keys and frames are
+# kept, so the numbers follow what's happening now rather than averaging over
+# the whole game.
+
+import json
+from time import perf_counter
+from bisect import bisect_right
+from collections import deque
+
+
+
+WINDOW = 600
+
+# histogram buckets, in milliseconds: a key lands in the first bucket it's
+# under, or the last one if it's slower than all of them
+BUCKETS = [1, 2, 4, 8, 16, 33, 66, 133, 266]
+
+# the HUD doesn't need redrawing every frame, and would count towards the
+# bytes per frame if it was
+HUD_INTERVAL = 0.25
+
+HUD_WIDTH = 72
+
+
+
+def percentile(samples, fraction):
+  if not samples:
+    return 0.0
+
+  ordered = sorted(samples)
+
+  return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def histogram(samples):
+  counts = [0] * (len(BUCKETS) + 1)
+
+  for sample in samples:
+    counts[bisect_right(BUCKETS, sample)] += 1
+
+  labels = [f"<{bucket}ms" for bucket in BUCKETS] + [f">={BUCKETS[-1]}ms"]
+
+  return dict(zip(labels, counts))
+
+
+
+class Frame_Stats:
+  def __init__(self):
+    self.pressed     = []
+    self.latencies   = deque(maxlen=WINDOW)
+    self.frame_times = deque(maxlen=WINDOW)
+    self.frame_bytes = deque(maxlen=WINDOW)
+    self.keys        = 0
+    self.frames      = 0
+    self.last_bytes  = 0
+    self.last_hud    = 0.0
+
+
+  def key_down(self, timestamp):
+    self.pressed.append(timestamp)
+
+
+  # called once a frame's been flushed, with when it started and how many bytes
+  # have been written to the terminal so far
+  def frame(self, start, total_bytes):
+    end = perf_counter()
+
+    for timestamp in self.pressed:
+      self.latencies.append(1000 * (end - timestamp))
+
+    self.keys += len(self.pressed)
+    self.pressed.clear()
+
+    self.frame_times.append(1000 * (end - start))
+    self.frame_bytes.append(total_bytes - self.last_bytes)
+    self.frames += 1
+    self.last_bytes = total_bytes
+
+
+  def hud_due(self):
+    now = perf_counter()
+
+    if now - self.last_hud < HUD_INTERVAL:
+      return False
+
+    self.last_hud = now
+    return True
+
+
+  # bytes written outside of a frame (the first paint, the HUD itself) don't
+  # count towards the next one
+  def skip_bytes(self, written):
+    self.last_bytes += written
+
+
+  def hud(self):
+    latencies = self.latencies
+    frame_times = self.frame_times
+    average_bytes = sum(self.frame_bytes) / len(self.frame_bytes) if self.frame_bytes else 0
+
+    text = (f"Keys: p50 {percentile(latencies, 0.5):.1f}ms p99 {percentile(latencies, 0.99):.1f}ms"
+            f" | Frames: p50 {percentile(frame_times, 0.5):.1f}ms p99 {percentile(frame_times, 0.99):.1f}ms"
+            f" | {average_bytes:.0f} B/frame")
+
+    return f"{text: <{HUD_WIDTH}}"
+
+
+  def report(self):
+    return {
+      "keys": self.keys,
+      "frames": self.frames,
+      "window": WINDOW,
+      "latency_ms": {
+        "p50": percentile(self.latencies, 0.5),
+        "p90": percentile(self.latencies, 0.9),
+        "p99": percentile(self.latencies, 0.99),
+        "max": max(self.latencies, default=0.0),
+        "histogram": histogram(self.latencies)},
+      "frame_ms": {
+        "p50": percentile(self.frame_times, 0.5),
+        "p99": percentile(self.frame_times, 0.99),
+        "max": max(self.frame_times, default=0.0),
+        "histogram": histogram(self.frame_times)},
+      "bytes_per_frame": {
+        "mean": sum(self.frame_bytes) / len(self.frame_bytes) if self.frame_bytes else 0,
+        "max": max(self.frame_bytes, default=0)}}
+
+
+  def dump(self, filename):
+    with open(filename, "w") as f:
+      json.dump(self.report(), f, indent=2)
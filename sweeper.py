@@ -5,18 +5,28 @@
 # cognito perceptu, "static w lightning tickles" https://freesound.org/people/cognito%20perceptu/sounds/98006/ (used without modification)
 # Iwiploppenisse, "Explosion" https://freesound.org/people/Iwiploppenisse/sounds/156031/ (used without modification)
 
-# NOTE: REQUIRES A TERMINAL THAT CAN DO 24-BIT COLOUR, LIKE ITERM2
+# NOTE: LOOKS BEST IN A TERMINAL THAT CAN DO 24-BIT COLOUR, LIKE ITERM2. 256 and
+# 16 colour terminals get the nearest colours they can show (see --depth).
 
 
 
+from time import perf_counter
 from shutil import get_terminal_size as spaces
 from contextlib  import contextmanager
-from random import randint, choice
-from itertools import chain
+from bisect import bisect_right
+from random import Random
+from itertools import chain, groupby
+from collections import deque
 from logging import basicConfig, INFO, WARNING, info, warning
 from argparse import ArgumentParser, RawDescriptionHelpFormatter
 
-from ansi import ansi, ANSI_CLEAR
+from probability import Probability_Engine
+from tiled import Tiled_Field, find_root, join_rows
+from stats import Frame_Stats
+from history import History
+from ansi import (ansi, ANSI_CLEAR, COLOUR_DEPTHS, Encoder, compile_code,
+                  detect_depth, gradient_palette, parse_code, parse_moniker,
+                  validate_hex)
 
 
 # I'll probably make this more sophisticated later
@@ -28,6 +38,9 @@ PLAYER_COLOUR       = "AF5FAF"
 PLAYER_FIELD_COLOUR = "4d1b29"
 HIGHLIGHT_COLOUR    = "00FF00"
 
+PALETTE = [BOMB_COLOUR, FLAG_COLOUR, SPACE_COLOUR, FIELD_COLOUR,
+           PLAYER_COLOUR, PLAYER_FIELD_COLOUR, HIGHLIGHT_COLOUR]
+
 # colour schemes poached from matplotlib, but hardcoded because I'm not loading
 # matplotlib just to dynamically generate colour schemes.
 
@@ -101,8 +114,58 @@ COLOUR_SCHEMES = {
                  "ff7e81",
                  "ffb847"]}
 
-# initialized now, loaded later from user input
-COLOURS = []
+DEFAULT_COLOUR_SCHEME = "gist_earth"
+
+# more colour schemes can be made by listing monikers in here, one per line,
+# e.g. "%x<#1b0c41>em%x<#cf4446>be%x<#fb9b06>rs". The name is the moniker's
+# text, and its colours are stretched out into a gradient of 7.
+SCHEMES_FILE = "schemes.txt"
+
+
+
+# returns the schemes, and what was wrong with any lines that couldn't be used;
+# those get logged by main() once logging's been set up
+def load_schemes(filename):
+  schemes = {}
+  problems = []
+
+  try:
+    with open(filename) as f:
+      lines = [line.strip() for line in f]
+
+  except OSError:
+    return schemes, problems
+
+  for line in lines:
+    if not line or line.startswith("#"):
+      continue
+
+    try:
+      name, colour_scheme = parse_moniker(line)
+
+    except IndexError:
+      problems.append(f"Couldn't read colour scheme {line!r}.")
+      continue
+
+    if not all(validate_hex(hex) for hex, _ in colour_scheme):
+      problems.append(f"Colour scheme {name!r} has a bad colour in it.")
+      continue
+
+    schemes[name] = line
+
+  return schemes, problems
+
+
+# only the monikers are kept around; a scheme's gradient gets worked out the
+# first time it's actually used
+USER_SCHEMES, SCHEME_PROBLEMS = load_schemes(SCHEMES_FILE)
+
+
+def number_colours(name=DEFAULT_COLOUR_SCHEME, user_schemes=USER_SCHEMES):
+  if name in COLOUR_SCHEMES:
+    return COLOUR_SCHEMES[name]
+
+  return list(gradient_palette(user_schemes[name]))
 
 
 
@@ -113,13 +176,22 @@ schemes = []
 for colour in COLOUR_SCHEMES:
   schemes.append(ANSI_CLEAR + colour + ":\n  " + " ".join([ansi(colour, str(i)) for i, colour in enumerate(COLOUR_SCHEMES[colour], 1)]))
 
+for moniker in USER_SCHEMES.values():
+  schemes.append(ANSI_CLEAR + parse_code(moniker) + ANSI_CLEAR + " (" + SCHEMES_FILE + ")")
+
 colour_scheme_message += "\n\n".join(schemes) + ANSI_CLEAR
 
 argparser = ArgumentParser(epilog=colour_scheme_message, formatter_class=RawDescriptionHelpFormatter)
 
 argparser.add_argument("-m", "--mode", help="Selects a mode (default or soldier).", metavar="<mode>", default="default")
 argparser.add_argument("-a", "--area", help="Defines the area of the field. Defaults to the largest size that will fit in the terminal window.", metavar="<int width>x<int height>", default=None)
-argparser.add_argument("-c", "--colour", help="Sets the colour scheme of the minefield's numbers (default: gist_earth).", metavar="<name>", default="gist_earth")
+argparser.add_argument("-c", "--colour", help=f"Sets the colour scheme of the minefield's numbers (default: {DEFAULT_COLOUR_SCHEME}).", metavar="<name>", default=DEFAULT_COLOUR_SCHEME)
+argparser.add_argument("-g", "--gradients", help=f"Reads extra colour schemes from a file of monikers (default: {SCHEMES_FILE}).", metavar="<file>", default=SCHEMES_FILE)
+argparser.add_argument("-j", "--jobs", help="Generates the field on this many processes at once, for really big fields (needs Python 3.8; default: 1).", metavar="<int>", type=int, default=1)
+argparser.add_argument("-d", "--depth", help="Sets the colour depth of the terminal (truecolor, 256 or 16). Defaults to guessing from the environment.", metavar="<depth>", default=None, choices=COLOUR_DEPTHS)
+argparser.add_argument("--auto-chord", help="Reveals around a number as soon as it has enough flags next to it (toggle in game with c).", action="store_true")
+argparser.add_argument("--stats", help="Shows how long keys take to show up, and how much gets drawn a frame, above the status line.", action="store_true")
+argparser.add_argument("--stats-file", help="Writes those stats to a file as JSON when the game ends.", metavar="<file>", default=None)
 BOMBS = argparser.add_mutually_exclusive_group()
 
 BOMBS.add_argument("-b", "--bombs", help="Sets the number of bombs on the field per game. (mutually exclusive with -B)", metavar="<int>", default=0)
@@ -214,35 +286,77 @@ def suppress_stdout():
       stdout = old_stdout
 
 
-# yes, I know this is jank to have a floating window that controls a terminal
-# window. This is the only way I know how to accept keyboard input at the
-# moment.
 with suppress_stdout():
   import pygame
-  pygame.mixer.init(buffer=512)
-  pygame.display.init()
-  pygame.display.set_mode(size=(100, 100))
-  pygame.key.set_repeat(250, 30)
 
 
+# yes, I know this is jank to have a floating window that controls a terminal
+# window. This is the only way I know how to accept keyboard input at the
+# moment. Only done when actually playing locally, so the key names can be
+# used without popping a window up (see server.py).
+def init_pygame():
+  with suppress_stdout():
+    pygame.mixer.init(buffer=512)
+    pygame.display.init()
+    pygame.display.set_mode(size=(100, 100))
+    pygame.key.set_repeat(250, 30)
+
+
+
+class Speaker:
+  def __init__(self):
+    # background ambience, so, quiet
+    pygame.mixer.music.load("static.wav")
+    pygame.mixer.music.set_volume(0.2)
+
+    self.number_sounds = [
+      pygame.mixer.Sound("1.wav"),
+      pygame.mixer.Sound("2.wav"),
+      pygame.mixer.Sound("3.wav"),
+      pygame.mixer.Sound("4.wav"),
+      pygame.mixer.Sound("5.wav"),
+      pygame.mixer.Sound("6.wav"),
+      pygame.mixer.Sound("7.wav")]
 
-# background ambience, so, quiet
-pygame.mixer.music.load("static.wav")
-pygame.mixer.music.set_volume(0.2)
+    # This sound is just super loud compared to everything else, so I throttled it
+    # way down
+    self.explosion = pygame.mixer.Sound("explosion.wav")
+    self.explosion.set_volume(0.1)
 
-NUMBER_SOUNDS = [
-  pygame.mixer.Sound("1.wav"),
-  pygame.mixer.Sound("2.wav"),
-  pygame.mixer.Sound("3.wav"),
-  pygame.mixer.Sound("4.wav"),
-  pygame.mixer.Sound("5.wav"),
-  pygame.mixer.Sound("6.wav"),
-  pygame.mixer.Sound("7.wav")]
 
-# This sound is just super loud compared to everything else, so I throttled it
-# way down
-EXPLOSION = pygame.mixer.Sound("explosion.wav")
-EXPLOSION.set_volume(0.1)
+  def number(self, number):
+    self.number_sounds[number - 1].play()
+
+
+  def explode(self):
+    self.explosion.play()
+
+
+  def start_music(self):
+    pygame.mixer.music.play(loops=-1)
+
+
+  def stop_music(self):
+    pygame.mixer.music.stop()
+
+
+
+# for games nobody is sitting in front of
+class Silence:
+  def number(self, number):
+    pass
+
+
+  def explode(self):
+    pass
+
+
+  def start_music(self):
+    pass
+
+
+  def stop_music(self):
+    pass
 
 
 
@@ -255,22 +369,53 @@ DEFAULT_BOMB_PERCENTAGE = 0.2
 
 CARDINAL_NUDGE = [-1, 0, 1]
 NESW_NUDGE     = [(-1, 0), (0, -1), (1, 0), (0, 1)]
+DIRECTIONS     = {"up": (0, -1), "down": (0, 1), "left": (-1, 0), "right": (1, 0)}
+
+# what each byte of a Tiled_Field means
+TILE_SPACES = [SPACE, 1, 2, 3, 4, 5, 6, 7, 8, BOMB]
 
 
 
 class Minefield:
   def __init__(self, width=None, height=None, bombs=0,
-                     bomb_percentage=DEFAULT_BOMB_PERCENTAGE, mode="standard"):
+                     bomb_percentage=DEFAULT_BOMB_PERCENTAGE, mode="standard",
+                     screen=None, audio=None, jobs=1, auto_chord=False,
+                     colours=None, seed=None, history_steps=None):
     columns, lines   = spaces(fallback=(30, 20))
     self.width       = width  or columns
     self.height      = height or lines - 2
     self.bombs       = bombs  or int((self.width * self.height) * bomb_percentage)
     self.mode        = mode
+    self.screen      = screen or Encoder()
+    self.audio       = audio  or Silence()
+    self.show_odds   = False
+    self.jobs        = jobs
+    self.auto_chord  = auto_chord
+    self.colours     = list(colours or number_colours())
+    self.random      = Random(seed)
+    self.history_steps = history_steps
+
+    # the story carries on from game to game, but every minefield has its own
+    self.narrative   = deque(MELANCHOLY)
+
+    self.screen.preload(PALETTE + self.colours)
 
 
   def initialize_grid(self):
     self.grid        = [[    "" for _ in range(self.width)] for _ in range(self.height)]
     self.player_grid = [[HIDDEN for _ in range(self.width)] for _ in range(self.height)]
+    self.odds        = Probability_Engine(self, HIDDEN, FLAG)
+    self.overlay     = {}
+    self.history     = History(self.history_steps)
+    self.highlighted = set()
+    self.chords      = deque()
+
+    # kept up to date by set_space, so chording never has to look around
+    columns = [min(x + 1, self.width - 1) - max(x - 1, 0) + 1 for x in range(self.width)]
+    rows    = [min(y + 1, self.height - 1) - max(y - 1, 0) + 1 for y in range(self.height)]
+
+    self.adjacent_flags  = [[0 for _ in range(self.width)] for _ in range(self.height)]
+    self.adjacent_hidden = [[column * row - 1 for column in columns] for row in rows]
 
     info(f"Grid initialized. height: {len(self.grid)}. width: {len(self.grid[0])}.")
 
@@ -282,8 +427,8 @@ class Minefield:
 
   def place_bomb(self):
     while True:
-      bomb_x = randint(1, self.width - 2)
-      bomb_y = randint(1, self.height - 2)
+      bomb_x = self.random.randint(1, self.width - 2)
+      bomb_y = self.random.randint(1, self.height - 2)
 
       if self.grid[bomb_y][bomb_x] == BOMB:
         continue
@@ -375,15 +520,17 @@ class Minefield:
 
   def calculate_open_spaces(self, grid):
     open_spaces = []
+    discovered_spaces = set()
 
     for x in range(self.width):
       for y in range(self.height):
         try:
-          if (x, y) in chain(*open_spaces):
+          if (x, y) in discovered_spaces:
             continue
 
           else:
             open_spaces.append(self.open_space(x, y, grid))
+            discovered_spaces |= open_spaces[-1]
 
         except ValueError:
           continue
@@ -412,7 +559,7 @@ class Minefield:
   def open_enclosure(self, enclosure):
     try:
       while True:
-        x, y = choice(list(enclosure))
+        x, y = self.random.choice(list(enclosure))
 
         adjustment = False
 
@@ -441,6 +588,58 @@ class Minefield:
         break
 
 
+  # The open regions never change once the numbers are in, so they're worked out
+  # once, a row of runs of open spaces at a time (see tiled.py). Each region is
+  # kept as what revealing any of it reveals: a box around each of its runs,
+  # taking in the layer of numbers around it.
+  def label_regions(self):
+    parents = []
+    rows = []
+    previous_runs = []
+
+    for row in self.grid:
+      runs = []
+      x = 0
+
+      for space, run in groupby(row):
+        end = x + len(list(run))
+
+        if space is SPACE:
+          runs.append((x, end, len(parents)))
+          parents.append(len(parents))
+
+        x = end
+
+      join_rows(parents, previous_runs, runs)
+      rows.append(runs)
+      previous_runs = runs
+
+    labels = {}
+    self.regions       = []
+    self.region_starts = []
+    self.region_labels = []
+
+    for y, runs in enumerate(rows):
+      self.region_starts.append([start for start, _, _ in runs])
+      self.region_labels.append([])
+
+      for start, end, run in runs:
+        root = find_root(parents, run)
+
+        if root not in labels:
+          labels[root] = len(self.regions)
+          self.regions.append([])
+
+        self.regions[labels[root]].append((max(y - 1, 0), min(y + 2, self.height), max(start - 1, 0), min(end + 1, self.width)))
+        self.region_labels[y].append(labels[root])
+
+    info(f"{len(self.regions)} open regions labelled.")
+
+
+  def region_of(self, x, y):
+    return self.region_labels[y][bisect_right(self.region_starts[y], x) - 1]
+
+
   def reveal_edges(self):
     # as the edges are guaranteed not to have bombs, the game starts with the
     # edges (and any open space connected to the edges) already revealed.
@@ -452,72 +651,112 @@ class Minefield:
       self.reveal(space)
 
 
+  # bombs, enclosures and numbers all at once, spread over self.jobs processes
+  def tiled_generation(self):
+    info(f"Generating on {self.jobs} processes.")
+    field = Tiled_Field(self.width, self.height, self.bombs, jobs=self.jobs, seed=self.random.getrandbits(64)).generate()
+
+    self.grid = [[TILE_SPACES[space] for space in field[y * self.width:(y + 1) * self.width]]
+                 for y in range(self.height)]
+
+
   def generate_game(self):
-    print("\033[2J\033[3J\033[H", end="", flush=True)
+    self.screen.raw("\033[2J\033[3J\033[H")
+    self.screen.flush()
     self.initialize_grid()
-    self.bomb_propagation()
-    self.check_for_enclosures()
-    self.calculate_all_numbers()
+
+    if self.jobs > 1:
+      self.tiled_generation()
+
+    else:
+      self.bomb_propagation()
+      self.check_for_enclosures()
+      self.calculate_all_numbers()
+
+    self.label_regions()
     self.reveal_edges()
     self.flags      = 0
     self.cursor     = [0, 0]
-    self.status_line = ""
-    self.melahcholy = randint(*MELANCHOLY_LENGTH)
+    self.target     = None
+    self.paths      = None
+    self.set_status("")
+    self.melancholy = self.random.randint(*MELANCHOLY_LENGTH)
     self.playing    = True
-    print("\033[2J\033[3J\033[H" + self.player_visible(), end="", flush=True)
+    self.paint()
+    self.audio.start_music()
 
 
-  def render_space(self, space, highlight=False):
+  # (foreground, background, character) for a space; None means the terminal's
+  # default colour
+  def space_style(self, space, highlight=False):
     if highlight:
-      return ANSI_CLEAR + ansi(HIGHLIGHT_COLOUR, HIDDEN)
-
-    message = ANSI_CLEAR
+      return HIGHLIGHT_COLOUR, None, HIDDEN
 
     if space is HIDDEN:
-      message += ansi(FIELD_COLOUR, HIDDEN)
+      return FIELD_COLOUR, None, HIDDEN
 
     elif space is BOMB:
-      message += ansi(BOMB_COLOUR, BOMB)
+      return BOMB_COLOUR, None, BOMB
 
     elif space is FLAG:
-      message += ansi(FIELD_COLOUR, "", background=True) + ansi(FLAG_COLOUR, FLAG)
+      return FLAG_COLOUR, FIELD_COLOUR, FLAG
 
     elif isinstance(space, int):
-      message += ansi(COLOURS[space], str(space))
+      return self.colours[space - 1], None, str(space)
 
     else:
-      message += " "
+      return None, None, SPACE
+
+
+  def cell_style(self, x, y, highlight=False):
+    if (x, y) in self.overlay and not highlight:
+      return self.overlay[x, y], None, HIDDEN
 
-    return message
+    return self.space_style(self.player_grid[y][x], highlight=highlight)
 
 
-  def player_visible(self):
-    return f"\n".join("".join([self.render_space(space) for space in line]) for line in self.player_grid) + ANSI_CLEAR
+  def paint(self, screen=None):
+    screen = screen or self.screen
+
+    # whatever's been drawn since the last flush (generate_game revealing the
+    # edges, say) would only be cleared straight away
+    screen.discard()
+    screen.reset()
+    screen.raw("\033[2J\033[3J\033[H")
+
+    for y in range(self.height):
+      if y:
+        screen.raw("\n")
+
+      screen.cells([self.cell_style(x, y) for x in range(self.width)])
+
+    screen.reset()
+    info(f"Full paint: {screen.flush()} bytes.")
 
 
   def show_cursor(self):
     x, y = self.cursor
+    space = self.player_grid[y][x]
+    self.screen.move(x, y)
 
-    if self.player_grid[y][x] == HIDDEN:
-      return f"\033[{y + 1};{x + 1}H" + ansi(PLAYER_FIELD_COLOUR, SPACE, background=True)
+    if space == HIDDEN:
+      self.screen.text(None, PLAYER_FIELD_COLOUR, SPACE)
 
-    elif isinstance(self.player_grid[y][x], int):
-      return f"\033[{y + 1};{x + 1}H" + ansi(PLAYER_COLOUR, "", background=True) + ansi(COLOURS[self.player_grid[y][x]], f"{self.player_grid[y][x]}")
+    elif isinstance(space, int):
+      self.screen.text(self.colours[space - 1], PLAYER_COLOUR, str(space))
 
-    elif self.player_grid[y][x] == FLAG:
-      return f"\033[{y + 1};{x + 1}H" + ansi(PLAYER_FIELD_COLOUR, "", background=True) + ansi(FLAG_COLOUR, FLAG)
+    elif space == FLAG:
+      self.screen.text(FLAG_COLOUR, PLAYER_FIELD_COLOUR, FLAG)
 
     else:
-      return f"\033[{y + 1};{x + 1}H" + ansi(PLAYER_COLOUR, SPACE, background=True)
-
-
-  def move_cursor(self, old_cursor):
-    x, y = old_cursor
-    for nudge_x, nudge_y in self.adjacencies(x, y):
-      self.print_at_cursor(nudge_x, nudge_y)
+      self.screen.text(None, PLAYER_COLOUR, SPACE)
 
 
   def move_player(self, direction):
+    if self.target is not None:
+      self.move_target(direction)
+      return
+
     x, y = getattr(self, f"cursor_{direction}")()
 
     if x < 0:
@@ -539,15 +778,47 @@ class Minefield:
       self.reveal(self.cursor)
 
 
+  # buffered until the end of the frame (see show_status_line)
   def print_at_cursor(self, x, y, highlight=False):
-    print(f"\033[{y + 1};{x + 1}H" + self.render_space(self.player_grid[y][x], highlight=highlight), end="", flush=True)
+    self.screen.move(x, y)
+    self.screen.text(*self.cell_style(x, y, highlight=highlight))
+
+
+  # every change to what the player can see goes through here, so anything
+  # keeping track of the board can hear about it
+  def set_space(self, x, y, space):
+    previous_space = self.player_grid[y][x]
+    self.player_grid[y][x] = space
+
+    if previous_space != space:
+      self.history.record(x, y, previous_space, space)
+      self.paths = None
+      self.odds.touch(x, y)
+      self.overlay.pop((x, y), None)
+
+      hidden_change = (space == HIDDEN) - (previous_space == HIDDEN)
+      flag_change   = (space == FLAG)   - (previous_space == FLAG)
+
+      if hidden_change or flag_change:
+        for adjacent_x, adjacent_y in self.adjacencies(x, y):
+          self.adjacent_hidden[adjacent_y][adjacent_x] += hidden_change
+          self.adjacent_flags[adjacent_y][adjacent_x]  += flag_change
+
+          if flag_change > 0 and self.auto_chord:
+            self.chords.append((adjacent_x, adjacent_y))
+
+      if isinstance(space, int) and self.auto_chord:
+        self.chords.append((x, y))
+
+    return previous_space
 
 
   def reveal_spaces(self, x, y):
-    for space in self.open_space(x, y, self.grid):
-      # also reveals a layer of numbers around the open spaces
-      for adjacency in self.adjacencies(*space):
-        self.reveal(adjacency, reveal_spaces=True)
+    for top, bottom, left, right in self.regions[self.region_of(x, y)]:
+      for space_y in range(top, bottom):
+        for space_x in range(left, right):
+          if self.player_grid[space_y][space_x] == HIDDEN:
+            self.reveal((space_x, space_y), reveal_spaces=True)
 
 
   def reveal(self, cursor=None, reveal_spaces=False):
@@ -560,22 +831,161 @@ class Minefield:
     if self.player_grid[y][x] == FLAG:
       return
 
-    previous_space = self.player_grid[y][x]
-    self.player_grid[y][x] = self.grid[y][x]
+    previous_space = self.set_space(x, y, self.grid[y][x])
     self.print_at_cursor(x, y)
 
     if self.player_grid[y][x] == BOMB:
-      self.status_line = choice(YOU_DIED)
-      EXPLOSION.play()
+      self.set_status(self.random.choice(YOU_DIED))
+      self.audio.explode()
       # autoprints next to the bomb in red, handily
-      print("KABOOM")
+      self.screen.raw("KABOOM\n")
+      self.screen.flush()
+      self.history.smudge([(kaboom_x, y) for kaboom_x in range(x + 1, min(x + 7, self.width))])
       raise Lose_Condition
 
     elif previous_space != SPACE and self.player_grid[y][x] == SPACE and not reveal_spaces:
       self.reveal_spaces(x, y)
 
     elif not isinstance(previous_space, int) and isinstance(self.player_grid[y][x], int) and not reveal_spaces:
-      NUMBER_SOUNDS[self.player_grid[y][x] - 1].play()
+      self.audio.number(self.player_grid[y][x])
+
+
+  # Soldier mode travel: the first press puts down a target that moves instead
+  # of the soldier, the second walks the soldier there in one go along the
+  # shortest route over ground that's already been cleared.
+  def travel(self):
+    if self.mode != "soldier":
+      return
+
+    if self.target is None:
+      self.target = list(self.cursor)
+      return
+
+    target = tuple(self.target)
+    self.target = None
+    self.print_at_cursor(*target)
+
+    path = self.path_to(target)
+
+    if path:
+      self.walk(path)
+
+
+  def move_target(self, direction):
+    nudge_x, nudge_y = DIRECTIONS[direction]
+    x, y = self.target
+
+    self.print_at_cursor(x, y)
+    self.target = [(x + nudge_x) % self.width, (y + nudge_y) % self.height]
+
+
+  def toggle_odds(self):
+    self.show_odds = not self.show_odds
+
+    if not self.show_odds:
+      for x, y in list(self.overlay):
+        del self.overlay[x, y]
+        self.print_at_cursor(x, y)
+
+
+  def odds_colour(self, probability):
+    return self.colours[min(len(self.colours) - 1, int(probability * len(self.colours)))]
+
+
+  # colours every hidden space by how likely it is to be a mine, only
+  # repainting the ones that changed colour
+  def show_overlay(self):
+    if not self.show_odds or not self.odds.stale() and self.overlay:
+      return
+
+    self.odds.refresh()
+    overlay = {(x, y): self.odds_colour(self.odds.probability(x, y)) for x, y in self.odds.hidden}
+    previous_overlay = self.overlay
+    self.overlay = overlay
+
+    for space in previous_overlay.keys() | overlay.keys():
+      if previous_overlay.get(space) != overlay.get(space):
+        self.print_at_cursor(*space)
+
+
+  def show_target(self):
+    if self.target is not None:
+      self.highlight(self.target)
+
+
+  def walkable(self, x, y):
+    return self.player_grid[y][x] not in (HIDDEN, FLAG, BOMB)
+
+
+  # distance and previous step for everywhere the soldier can walk to from where
+  # they're standing. Walking around only wraps around the edges, same as
+  # move_player; only revealing something changes where you can go, so this is
+  # kept until something is revealed (or the soldier is somewhere else).
+  def distance_field(self):
+    start = tuple(self.cursor)
+
+    if self.paths is not None and self.paths[0] == start:
+      return self.paths[1]
+
+    field = {start: (0, None)}
+    frontier = [start]
+
+    while frontier:
+      next_frontier = []
+
+      for x, y in frontier:
+        distance = field[x, y][0] + 1
+
+        for nudge_x, nudge_y in NESW_NUDGE:
+          step = ((x + nudge_x) % self.width, (y + nudge_y) % self.height)
+
+          if step not in field and self.walkable(*step):
+            field[step] = (distance, (x, y))
+            next_frontier.append(step)
+
+      frontier = next_frontier
+
+    self.paths = (start, field)
+
+    return field
+
+
+  # every step from (not including) the cursor to target, or None if there's
+  # no way there. A hidden target is fine, as long as the soldier can get
+  # next to it; the last step is onto it.
+  def path_to(self, target):
+    field = self.distance_field()
+    x, y = target
+    last_step = None
+
+    if target not in field:
+      if self.player_grid[y][x] != HIDDEN:
+        return None
+
+      nearby = [((x + nudge_x) % self.width, (y + nudge_y) % self.height) for nudge_x, nudge_y in NESW_NUDGE]
+      nearby = [space for space in nearby if space in field]
+
+      if not nearby:
+        return None
+
+      last_step = target
+      target = min(nearby, key=lambda space: field[space][0])
+
+    path = [] if last_step is None else [last_step]
+
+    while field[target][1] is not None:
+      path.append(target)
+      target = field[target][1]
+
+    return path[::-1]
+
+
+  def walk(self, path):
+    self.print_at_cursor(*self.cursor)
+    self.cursor = list(path[-1])
+
+    # everything up to the end is already revealed, so only the end needs it
+    self.reveal(self.cursor)
 
 
   # TODO: make a cursor object that can, at the very least, push all these
@@ -609,47 +1019,76 @@ class Minefield:
     previous_character = self.player_grid[y][x]
 
     if previous_character == FLAG:
-      self.player_grid[y][x] = HIDDEN
+      self.set_space(x, y, HIDDEN)
       self.flags -= 1
 
     elif previous_character == HIDDEN:
-      self.player_grid[y][x] = FLAG
+      self.set_space(x, y, FLAG)
       self.flags += 1
 
     self.print_at_cursor(x, y)
 
 
+  # status lines can have {mines} in them, and are compiled once so redrawing
+  # them every frame is cheap
+  def set_status(self, text):
+    self.status_line = compile_code(text, fields=True)
+
+
   def show_flags(self):
     flags_remaining = self.bombs - self.flags
 
-    return ANSI_CLEAR + f"\033[{self.height + 2};{0}HFlags: {flags_remaining:>4} | {self.status_line.format(mines=flags_remaining): <{MAX_MELANCHOLY}}"
+    self.screen.move(0, self.height + 1)
+    self.screen.text(None, None, f"Flags: {flags_remaining:>4} | {self.status_line.render(mines=flags_remaining): <{MAX_MELANCHOLY}}")
 
 
-  def reveal_adjacent(self):
-    x, y = self.cursor
-    if not isinstance(self.player_grid[y][x], int):
-      return
+  # goes in the empty row between the field and the status line
+  def show_stats(self, stats):
+    self.screen.move(0, self.height)
+    self.screen.text(None, None, stats.hud())
 
-    flags_adjacent = 0
 
-    adjacent_spaces = self.adjacencies(x, y)
-    spaces_to_reveal = []
+  # Windows Minesweeper behaviour: Reveal adjacent spaces only if you're on a
+  # number, and only if you have that number of flags adjacent to it.
+  def satisfied(self, x, y):
+    space = self.player_grid[y][x]
 
-    # Windows Minesweeper behaviour: Reveal adjacent spaces only if you're on a
-    # number, and only if you have that number of flags adjacent to it.
-    # TODO: DRY this
-    for adjacent_x, adjacent_y in adjacent_spaces:
-      if self.player_grid[adjacent_y][adjacent_x] == FLAG:
-        flags_adjacent += 1
+    return isinstance(space, int) and self.adjacent_flags[y][x] == space and self.adjacent_hidden[y][x] > 0
+
+
+  def hidden_adjacent(self, x, y):
+    return [(adjacent_x, adjacent_y) for adjacent_x, adjacent_y in self.adjacencies(x, y)
+            if self.player_grid[adjacent_y][adjacent_x] == HIDDEN]
 
-      elif self.player_grid[adjacent_y][adjacent_x] == HIDDEN:
-        spaces_to_reveal.append((adjacent_x, adjacent_y))
 
-    if flags_adjacent == self.player_grid[y][x]:
-      for space in spaces_to_reveal:
+  def chord(self, x, y):
+    if self.satisfied(x, y):
+      for space in self.hidden_adjacent(x, y):
         self.reveal(space)
 
 
+  def reveal_adjacent(self):
+    self.chord(*self.cursor)
+
+
+  # numbers that might have just got enough flags, or just got revealed
+  # already having them, queued up by set_space
+  def auto_chords(self):
+    while self.chords:
+      self.chord(*self.chords.popleft())
+
+
+  def toggle_auto_chord(self):
+    self.auto_chord = not self.auto_chord
+
+    # anything already satisfied gets chorded straight away
+    if self.auto_chord:
+      self.chords.extend((x, y) for y in range(self.height) for x in range(self.width) if self.satisfied(x, y))
+
+    else:
+      self.chords.clear()
+
+
   def check_board(self):
     if self.flags != self.bombs:
       return
@@ -662,28 +1101,68 @@ class Minefield:
     raise Win_Condition
 
 
+  # As some people click and hold on the button to reveal adjacent spaces to
+  # check their work, a highlight-adjacent-squares button was added that
+  # follows the same behaviour as revealing those adjacent squares. Called
+  # every frame it's held, so anything already highlighted is left alone.
   def highlight_adjacent(self):
     x, y = self.cursor
-    if not isinstance(self.player_grid[y][x], int):
+
+    if not self.satisfied(x, y):
       return
 
-    flags_adjacent = 0
-    spaces_to_highlight = []
+    for space in self.hidden_adjacent(x, y):
+      if space not in self.highlighted:
+        self.highlight(space)
 
-    # As some people click and hold on the button to reveal adjacent spaces to
-    # check their work, a highlight-adjacent-squares button was added that
-    # follows the same behaviour as revealing those adjacent squares.
-    # TODO: DRY this
-    for adjacent_x, adjacent_y in self.adjacencies(x, y):
-      if self.player_grid[adjacent_y][adjacent_x] == FLAG:
-        flags_adjacent += 1
 
-      elif self.player_grid[adjacent_y][adjacent_x] == HIDDEN:
-        spaces_to_highlight.append((adjacent_x, adjacent_y))
+  # everything an undo puts back besides the spaces themselves
+  def state(self):
+    return self.flags, tuple(self.cursor), self.status_line, self.playing
 
-    if flags_adjacent == self.player_grid[y][x]:
-      for space in spaces_to_highlight:
-        self.highlight(space)
+
+  def undo(self):
+    step = self.history.undo()
+
+    if step:
+      self.restore({space: old for space, (old, _) in step.changes.items()}, step.before, step.repaint)
+
+
+  def redo(self):
+    step = self.history.redo()
+
+    if step:
+      self.restore({space: new for space, (_, new) in step.changes.items()}, step.after, ())
+
+
+  # only the spaces that changed get redrawn
+  def restore(self, spaces, state, repaint):
+    self.history.applying = True
+
+    try:
+      for (x, y), space in spaces.items():
+        self.set_space(x, y, space)
+        self.print_at_cursor(x, y)
+
+    finally:
+      self.history.applying = False
+      self.chords.clear()
+
+    for x, y in repaint:
+      self.print_at_cursor(x, y)
+
+    self.print_at_cursor(*self.cursor)
+
+    self.flags, cursor, self.status_line, playing = state
+    self.cursor = list(cursor)
+
+    if playing and not self.playing:
+      self.audio.start_music()
+
+    elif self.playing and not playing:
+      self.audio.stop_music()
+
+    self.playing = playing
 
 
   MOVE_DISPATCH = {
@@ -698,7 +1177,20 @@ class Minefield:
     pygame.K_KP8: (flag, {"direction": "up"}),
     pygame.K_KP2: (flag, {"direction": "down"}),
     pygame.K_KP4: (flag, {"direction": "left"}),
-    pygame.K_KP6: (flag, {"direction": "right"})}
+    pygame.K_KP6: (flag, {"direction": "right"}),
+    pygame.K_t: (travel, {}),
+    pygame.K_p: (toggle_odds, {}),
+    pygame.K_z: (undo, {}),
+    pygame.K_y: (redo, {}),
+    pygame.K_c: (toggle_auto_chord, {})}
+
+  # keys that only move the cursor, so a run of them can be added up into one
+  # jump (see press_all)
+  JUMP_KEYS = {
+    pygame.K_w: "up",
+    pygame.K_s: "down",
+    pygame.K_a: "left",
+    pygame.K_d: "right"}
 
 
   def move(self, direction):
@@ -708,25 +1200,88 @@ class Minefield:
       f, args = self.MOVE_DISPATCH[direction]
 
       f(self, **args)
+      self.auto_chords()
+
+      self.count_down()
+
+
+  def count_down(self):
+    self.melancholy -= 1
+
+    if self.melancholy <= 0:
+      # intended to stop after a while, for now; more procedurally-generated
+      # text is possible, but probably way down the line, if at all
+      if self.narrative:
+        self.set_status(self.narrative.popleft())
+
+      self.melancholy = self.random.randint(*MELANCHOLY_LENGTH)
+
+
+  # Every key pulled off the queue in one frame. Held-down direction keys come
+  # in faster than frames, so runs of them become one jump to where they'd all
+  # have ended up, instead of a repaint each. Anything else (and soldiers, who
+  # reveal every space they step on) still goes one key at a time, in order.
+  def press_all(self, keys):
+    for jumping, run in groupby(keys, key=lambda key: key in self.JUMP_KEYS):
+      run = list(run)
+
+      if jumping and len(run) > 1 and self.playing and self.mode != "soldier" and self.target is None:
+        self.jump(run)
+
+      else:
+        for key in run:
+          self.press(key)
+
 
-      self.melancholy -= 1
+  def jump(self, keys):
+    self.unhighlight_adjacent()
+
+    x, y = self.cursor
 
-      if self.melancholy <= 0:
-        # intended to stop after a while, for now; more procedurally-generated
-        # text is possible, but probably way down the line, if at all
-        if MELANCHOLY:
-          self.status_line = MELANCHOLY.pop(0)
+    for key in keys:
+      nudge_x, nudge_y = DIRECTIONS[self.JUMP_KEYS[key]]
+      x += nudge_x
+      y += nudge_y
 
-        self.melancholy = randint(*MELANCHOLY_LENGTH)
+    self.print_at_cursor(*self.cursor)
+    self.cursor = [x % self.width, y % self.height]
+
+    for _ in keys:
+      self.count_down()
 
 
   def end_game(self):
     raise Game_End
 
 
+  # a single keypress, wherever it came from
+  def press(self, key):
+    self.history.begin(self.state())
+
+    try:
+      dispatch = self.move if self.playing else self.end
+      dispatch(key)
+
+    except Lose_Condition:
+      self.audio.stop_music()
+      self.playing = False
+
+    except Win_Condition:
+      self.audio.stop_music()
+      self.playing = False
+      self.win()
+
+    finally:
+      step = self.history.end(self.state())
+
+      if step:
+        info(f"History step: {len(step.changes)} spaces, {step.size()} bytes.")
+
+
   END_DISPATCH = {
     pygame.K_ESCAPE: end_game,
-    pygame.K_r: generate_game}
+    pygame.K_r: generate_game,
+    pygame.K_z: undo}
 
 
   def end(self, direction):
@@ -738,19 +1293,27 @@ class Minefield:
 
   def highlight(self, cursor):
     self.print_at_cursor(*cursor, highlight=True)
+    self.highlighted.add(tuple(cursor))
 
 
   def unhighlight_adjacent(self):
-    self.move_cursor(self.cursor)
+    for space in self.highlighted:
+      self.print_at_cursor(*space)
+
+    self.highlighted.clear()
 
 
   def win(self):
-    self.status_line = choice(YOU_WIN)
+    self.set_status(self.random.choice(YOU_WIN))
 
 
   # technically a misnomer, as it obviously shows the cursor too
   def show_status_line(self):
-    print(self.show_cursor() + self.show_flags(), end="", flush=True)
+    self.show_overlay()
+    self.show_target()
+    self.show_cursor()
+    self.show_flags()
+    self.screen.flush()
 
 
 
@@ -771,56 +1334,71 @@ def parse_area(area):
 
 
 
-def main(width, height, bombs, bomb_percentage, colour, mode):
+def main(width, height, bombs, bomb_percentage, colour, mode, depth, jobs, auto_chord=False, stats=None, show_stats=False, scheme_problems=()):
   basicConfig(
     filename=f"sweeper.log",
     level=INFO,
     format='%(asctime)s: %(message)s',
     datefmt='%Y-%m-%d %I:%M:%S %p')
 
-  global COLOURS
-  COLOURS = colour
+  for problem in scheme_problems:
+    warning(problem)
+
+  init_pygame()
 
   minefield = Minefield(width=width,
                         height=height,
                         bombs=bombs,
                         bomb_percentage=bomb_percentage,
-                        mode=mode)
+                        mode=mode,
+                        screen=Encoder(depth=depth or detect_depth()),
+                        audio=Speaker(),
+                        jobs=jobs,
+                        auto_chord=auto_chord,
+                        colours=colour)
 
   minefield.generate_game()
 
-  pygame.mixer.music.play(loops=-1)
   clock = pygame.time.Clock()
 
+  if stats:
+    stats.skip_bytes(minefield.screen.total_bytes)
+
   while True:
-    try:
-      minefield.show_status_line()
+    frame_start = perf_counter()
 
-      events = pygame.event.get()
+    events = pygame.event.get()
+    keys = []
 
-      for event in events:
-        if event.type == pygame.KEYDOWN:
-          dispatch = minefield.move if minefield.playing else minefield.end
-          dispatch(event.key)
+    for event in events:
+      if event.type == pygame.KEYDOWN:
+        if stats:
+          stats.key_down(perf_counter())
 
-      pressed = pygame.key.get_pressed()
+        keys.append(event.key)
 
-      if pressed[pygame.K_KP0]:
-        minefield.highlight_adjacent()
+    minefield.press_all(keys)
 
-      else:
-        minefield.unhighlight_adjacent()
+    pressed = pygame.key.get_pressed()
 
-      clock.tick(60)
+    if pressed[pygame.K_KP0]:
+      minefield.highlight_adjacent()
 
-    except Lose_Condition:
-      pygame.mixer.music.stop()
-      minefield.playing = False
+    else:
+      minefield.unhighlight_adjacent()
 
-    except Win_Condition:
-      pygame.mixer.music.stop()
-      minefield.playing = False
-      minefield.win()
+    # drawn after the keys rather than before, so they show up this frame
+    # instead of after the next tick
+    minefield.show_status_line()
+
+    if stats:
+      stats.frame(frame_start, minefield.screen.total_bytes)
+
+      if show_stats and stats.hud_due():
+        minefield.show_stats(stats)
+        stats.skip_bytes(minefield.screen.flush())
+
+    clock.tick(60)
 
 
 
@@ -831,7 +1409,9 @@ if __name__ == "__main__":
     width, height   = parse_area(args.area)
     bombs           = int(args.bombs)
     bomb_percentage = float(args.bomb_percent)
-    colour          = COLOUR_SCHEMES[args.colour]
+    user_schemes, scheme_problems = (USER_SCHEMES, SCHEME_PROBLEMS) if args.gradients == SCHEMES_FILE else load_schemes(args.gradients)
+    colour          = number_colours(args.colour, user_schemes)
+    stats           = Frame_Stats() if args.stats or args.stats_file else None
 
   except (KeyError, ValueError) as e:
     # TODO: Nicer error messages
@@ -841,7 +1421,7 @@ if __name__ == "__main__":
     quit()
 
   try:
-    main(width, height, bombs, bomb_percentage, colour, args.mode)
+    main(width, height, bombs, bomb_percentage, colour, args.mode, args.depth, args.jobs, args.auto_chord, stats, args.stats, scheme_problems)
 
   except Game_End:
     pass
@@ -849,4 +1429,7 @@ if __name__ == "__main__":
   finally:
     # cleans up the terminal after the game
 
-    print(ANSI_CLEAR + "\033[2J\033[3J\033[H", end="")
\ No newline at end of file
+    print(ANSI_CLEAR + "\033[2J\033[3J\033[H", end="")
+
+    if args.stats_file:
+      stats.dump(args.stats_file)
\ No newline at end of file
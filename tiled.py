@@ -0,0 +1,298 @@
+#!/Library/Frameworks/Python.framework/Versions/3.7/bin/python3.7
+
+# Generates really big minefields on every core at once.
+#
+# The field lives in one shared block of memory, a byte per space: 0-8 for the
+# number of bombs around it, BOMB_BYTE for a bomb. It's cut into bands of rows
+# (tiles), and a pool of processes works on the tiles in three passes:
+#
+#   1. place each tile's share of the bombs
+#   2. find the open (nonbomb) regions in each tile, which then get stitched
+#      together across tile borders here, so any enclosures can be opened
+#      (repeated until there aren't any)
+#   3. count the bombs around every space
+#
+# Deliberately doesn't import sweeper (and so pygame), as the workers import
+# this module. multiprocessing.shared_memory needs Python 3.8, so it's only
+# imported when a field actually gets generated here; sweeper also uses the
+# region labelling helpers, which work anywhere.
+
+import re
+from bisect import bisect_right
+from random import Random
+from multiprocessing import cpu_count
+
+
+
+BOMB_BYTE = 9
+
+# runs of nonbomb spaces in a row
+OPEN_RUN = re.compile(b"[^\x09]+")
+
+# bombs around a space come out as 0-8, and bombs themselves as 16 or more
+# (see count_tile); this squashes the latter down to BOMB_BYTE
+SETTLE = bytes([value if value < 16 else BOMB_BYTE for value in range(256)])
+
+# bomb or not, as a 1 or 0
+IS_BOMB = bytes([1 if value == BOMB_BYTE else 0 for value in range(256)])
+
+# a few tiles per process, so one slow tile doesn't hold everyone up
+TILES_PER_JOB = 4
+
+
+
+# Open regions get found a row at a time, as runs of spaces: runs in rows next
+# to each other that overlap are connected (NESW). Runs are (start, end,
+# label), and connected labels are joined up in parents, the earlier label
+# staying in charge. Sweeper labels its open regions the same way.
+def find_root(parents, label):
+  while parents[label] != label:
+    parents[label] = parents[parents[label]]
+    label = parents[label]
+
+  return label
+
+
+def union(parents, label_1, label_2):
+  root_1 = find_root(parents, label_1)
+  root_2 = find_root(parents, label_2)
+
+  if root_1 != root_2:
+    parents[max(root_1, root_2)] = min(root_1, root_2)
+
+
+def join_rows(parents, runs_1, runs_2):
+  i = j = 0
+
+  while i < len(runs_1) and j < len(runs_2):
+    start_1, end_1, label_1 = runs_1[i]
+    start_2, end_2, label_2 = runs_2[j]
+
+    if start_1 < end_2 and start_2 < end_1:
+      union(parents, label_1, label_2)
+
+    if end_1 <= end_2:
+      i += 1
+
+    else:
+      j += 1
+
+
+
+# every worker gets the shared field once, rather than with every tile
+FIELD = {}
+
+def attach(name, width, height):
+  from multiprocessing.shared_memory import SharedMemory
+
+  FIELD["memory"] = SharedMemory(name=name)
+  FIELD["width"]  = width
+  FIELD["height"] = height
+
+
+def place_tile(tile):
+  (top, bottom), bombs, seed = tile
+  width = FIELD["width"]
+  height = FIELD["height"]
+  buffer = FIELD["memory"].buf
+
+  # same as Minefield.place_bomb, no bombs on the edges
+  top = max(top, 1)
+  bottom = min(bottom, height - 1)
+  inner_width = width - 2
+
+  for spot in Random(seed).sample(range(inner_width * (bottom - top)), bombs):
+    y, x = divmod(spot, inner_width)
+    buffer[(top + y) * width + x + 1] = BOMB_BYTE
+
+
+# Labels the open regions of a tile, a run of nonbomb spaces at a time. A
+# region's label is the index of its first space, so it's unique across the
+# whole field. Returns the labelled runs along the top and bottom of the tile
+# (for stitching to the tiles around it) and the labels of all its regions.
+def label_tile(bounds):
+  top, bottom = bounds
+  width = FIELD["width"]
+  buffer = FIELD["memory"].buf
+  parents = []
+  previous_runs = []
+  rows = []
+
+  for y in range(top, bottom):
+    runs = []
+
+    for match in OPEN_RUN.finditer(bytes(buffer[y * width:(y + 1) * width])):
+      run = len(parents)
+      parents.append(run)
+      runs.append((match.start(), match.end(), run))
+
+    # the earliest run stays in charge, so the label is the first space
+    join_rows(parents, previous_runs, runs)
+    rows.append((y, runs))
+    previous_runs = runs
+
+  labels = {}
+
+  for y, runs in rows:
+    for start, _, run in runs:
+      if run == parents[run]:
+        labels[run] = y * width + start
+
+  def edge(runs):
+    return [(start, end, labels[find_root(parents, run)]) for start, end, run in runs]
+
+  return edge(rows[0][1]), edge(rows[-1][1]), list(labels.values())
+
+
+# counts every row's bombs at once by treating the row as one big number, a
+# byte per space: add the rows above and below, then shift it a space left and
+# right and add that too
+def count_tile(bounds):
+  top, bottom = bounds
+  width = FIELD["width"]
+  height = FIELD["height"]
+  buffer = FIELD["memory"].buf
+  mask = (1 << (8 * width)) - 1
+
+  def bombs(y):
+    if y < 0 or y >= height:
+      return 0
+
+    return int.from_bytes(bytes(buffer[y * width:(y + 1) * width]).translate(IS_BOMB), "big")
+
+  above, here = bombs(top - 1), bombs(top)
+
+  for y in range(top, bottom):
+    below = bombs(y + 1)
+    column = above + here + below
+    around = (column + (column << 8) + (column >> 8)) & mask
+
+    # bombs get pushed past 16 so they can be picked out again
+    counts = around - here + (here << 4)
+    buffer[y * width:(y + 1) * width] = counts.to_bytes(width, "big").translate(SETTLE)
+
+    above, here = here, below
+
+
+
+class Tiled_Field:
+  def __init__(self, width, height, bombs, jobs=None, seed=None):
+    self.width  = width
+    self.height = height
+    self.bombs  = bombs
+    self.jobs   = jobs or cpu_count()
+    self.random = Random(seed)
+
+    tiles = min(self.jobs * TILES_PER_JOB, max(1, height // 3))
+    self.edges = [round(height * i / tiles) for i in range(tiles + 1)]
+    self.tiles = list(zip(self.edges, self.edges[1:]))
+
+    # each tile's labelled regions, and which tiles need labelling again
+    self.labelled = [None] * len(self.tiles)
+    self.dirty    = set(range(len(self.tiles)))
+
+
+  def generate(self):
+    from multiprocessing import Pool
+    from multiprocessing.shared_memory import SharedMemory
+
+    memory = SharedMemory(create=True, size=self.width * self.height)
+
+    try:
+      memory.buf[:self.width * self.height] = bytes(self.width * self.height)
+
+      with Pool(self.jobs, initializer=attach, initargs=(memory.name, self.width, self.height)) as pool:
+        self.pool = pool
+        self.buffer = memory.buf
+
+        pool.map(place_tile, list(zip(self.tiles, self.share_bombs(), [self.random.getrandbits(64) for _ in self.tiles])))
+
+        while True:
+          enclosures = self.find_enclosures()
+
+          if not enclosures:
+            break
+
+          for enclosure in enclosures:
+            self.open_enclosure(enclosure)
+
+        pool.map(count_tile, self.tiles)
+
+        field = bytes(memory.buf[:self.width * self.height])
+
+    finally:
+      self.buffer = None
+      memory.close()
+      memory.unlink()
+
+    return field
+
+
+  # each tile's share of the bombs, by how much room it has for them
+  def share_bombs(self):
+    rooms = [max(0, min(bottom, self.height - 1) - max(top, 1)) * (self.width - 2) for top, bottom in self.tiles]
+    total = sum(rooms)
+    shares = [self.bombs * room // total for room in rooms]
+
+    for _ in range(self.bombs - sum(shares)):
+      while True:
+        tile = self.random.choices(range(len(rooms)), weights=rooms)[0]
+
+        if shares[tile] < rooms[tile]:
+          shares[tile] += 1
+          break
+
+    return shares
+
+
+  # stitches the tiles' regions together; every region but the one with the
+  # edges in it (whose label is 0, the top left corner) is an enclosure.
+  # Returns each enclosure as the labels of its pieces.
+  def find_enclosures(self):
+    dirty = sorted(self.dirty)
+
+    for i, labelled in zip(dirty, self.pool.map(label_tile, [self.tiles[i] for i in dirty])):
+      self.labelled[i] = labelled
+
+    self.dirty.clear()
+    tiles = self.labelled
+    parents = {}
+
+    for _, _, labels in tiles:
+      for label in labels:
+        parents[label] = label
+
+    for (_, bottom_runs, _), (top_runs, _, _) in zip(tiles, tiles[1:]):
+      join_rows(parents, bottom_runs, top_runs)
+
+    pieces = {}
+
+    for label in parents:
+      pieces.setdefault(find_root(parents, label), []).append(label)
+
+    del pieces[0]
+
+    return list(pieces.values())
+
+
+  # Same as Minefield.open_enclosure: knock down a bomb in its wall and put it
+  # somewhere else. The first space of any piece of an enclosure starts a run,
+  # so the space left of it is always a bomb (it can't be the edge, as the
+  # edges are never enclosed).
+  def open_enclosure(self, enclosure):
+    label = self.random.choice(enclosure)
+    self.buffer[label - 1] = 0
+    self.dirty.add(self.tile_of((label - 1) // self.width))
+
+    while True:
+      x = self.random.randint(1, self.width - 2)
+      y = self.random.randint(1, self.height - 2)
+
+      if self.buffer[y * self.width + x] != BOMB_BYTE:
+        self.buffer[y * self.width + x] = BOMB_BYTE
+        self.dirty.add(self.tile_of(y))
+        break
+
+
+  def tile_of(self, y):
+    return bisect_right(self.edges, y) - 1